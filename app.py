@@ -19,6 +19,8 @@ from datetime import datetime
 from bulk_processor import get_bulk_processor
 from preview_generator import get_preview_generator
 from config_manager import get_config_manager
+from model_registry import get_model_registry
+from calibration import get_host_calibration
 
 os.environ['NUMBA_CACHE_DIR'] = '/tmp/numba_cache'
 
@@ -42,6 +44,8 @@ app.config['CHECKPOINTS_FOLDER'] = 'checkpoints'
 app.config['TEMP_FOLDER'] = 'temp'
 app.config['CONFIG_FOLDER'] = 'config'
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
+app.config['MODEL_CACHE_MAX_MODELS'] = int(os.environ.get('MODEL_CACHE_MAX_MODELS', 2))
+app.config['MODEL_CACHE_MAX_MB'] = float(os.environ['MODEL_CACHE_MAX_MB']) if os.environ.get('MODEL_CACHE_MAX_MB') else None
 
 ALLOWED_FACE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'mp4', 'avi', 'mov'}
 ALLOWED_AUDIO_EXTENSIONS = {'wav', 'mp3', 'aac', 'flac'}
@@ -59,9 +63,12 @@ except OSError as e:
     sys.exit(1)
 
 # Initialize global instances
-bulk_processor = get_bulk_processor(app.config['RESULTS_FOLDER'], app.config['TEMP_FOLDER'])
+bulk_processor = get_bulk_processor(app.config['RESULTS_FOLDER'], app.config['TEMP_FOLDER'],
+                                    max_workers=int(os.environ.get('BULK_MAX_WORKERS', 1)))
 preview_generator = get_preview_generator(app.config['TEMP_FOLDER'])
 config_manager = get_config_manager(app.config['CONFIG_FOLDER'])
+model_registry = get_model_registry(app.config['MODEL_CACHE_MAX_MODELS'], app.config['MODEL_CACHE_MAX_MB'])
+host_calibration = get_host_calibration(app.config['CONFIG_FOLDER'])
 
 def allowed_file(filename, allowed_extensions):
     """Checks if a file's extension is allowed."""
@@ -199,6 +206,9 @@ def infer():
         for key in request.form:
             if key.startswith('micro_'):
                 param_name = key[6:]  # Remove 'micro_' prefix
+                if request.form[key] == 'auto':
+                    micro_changes[param_name] = 'auto'
+                    continue
                 try:
                     value = float(request.form[key])
                     micro_changes[param_name] = value
@@ -242,7 +252,21 @@ def infer():
                 box=settings.get('box', [-1, -1, -1, -1]),
                 face_det_batch_size=settings.get('face_det_batch_size', 8),
                 wav2lip_batch_size=settings.get('wav2lip_batch_size', 64),
-                img_size=settings.get('img_size', 96)
+                img_size=settings.get('img_size', 96),
+                video_codec=settings.get('video_codec', 'libx264'),
+                encoder_preset=settings.get('encoder_preset', 'veryfast'),
+                crf=settings.get('crf', 20),
+                encoder_threads=settings.get('encoder_threads', 0),
+                precision=settings.get('precision', 'fp32'),
+                memory_format=settings.get('memory_format', 'contiguous'),
+                backend=settings.get('backend', 'torch'),
+                detect_every=settings.get('detect_every', 1),
+                detect_scale=settings.get('detect_scale', 1),
+                box_smoothing=settings.get('box_smoothing', 'mean'),
+                track_faces=settings.get('track_faces', False),
+                face_detector=settings.get('face_detector', 'sfd'),
+                temp_dir=app.config['TEMP_FOLDER'],
+                output_dir=app.config['RESULTS_FOLDER']
             )
 
             # Generate comparison preview
@@ -479,6 +503,51 @@ def manage_user_settings():
         logger.error(f"Error managing user settings: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/model_cache', methods=['GET', 'DELETE'])
+def manage_model_cache():
+    """Inspect or clear the resident model registry."""
+    try:
+        if request.method == 'DELETE':
+            model_registry.clear()
+            return jsonify({'success': True})
+        return jsonify(model_registry.get_stats())
+    except Exception as e:
+        logger.error(f"Error managing model cache: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/calibration', methods=['GET', 'POST', 'DELETE'])
+def manage_calibration():
+    """Inspect, run or clear the batch size calibration of this host."""
+    try:
+        if request.method == 'POST':
+            data = request.get_json() or {}
+            model = data.get('model')
+            if not model or not allowed_file(model, ALLOWED_MODEL_EXTENSIONS):
+                return jsonify({'error': 'Model selection required'}), 400
+            checkpoint_path = os.path.join(app.config['CHECKPOINTS_FOLDER'], secure_filename(model))
+            if not os.path.isfile(checkpoint_path):
+                return jsonify({'error': 'Model not found'}), 404
+
+            # Calibrate in the inference mode of a preset, if one is given
+            preset = config_manager.get_preset(data['preset_id']) if data.get('preset_id') else None
+            settings = preset['settings'] if preset else {}
+            started = host_calibration.start(
+                checkpoint_path, [int(r) for r in data.get('resolutions', [720, 1080])],
+                precision=settings.get('precision', 'fp32'),
+                memory_format=settings.get('memory_format', 'contiguous'),
+                backend=settings.get('backend', 'torch'))
+            if not started:
+                return jsonify({'error': 'Calibration already running'}), 409
+            return jsonify({'success': True, 'status': host_calibration.status}), 202
+
+        if request.method == 'DELETE':
+            host_calibration.clear()
+            return jsonify({'success': True})
+        return jsonify(host_calibration.get_stats())
+    except Exception as e:
+        logger.error(f"Error managing calibration: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/result_page/<filename>')
 def render_result_page(filename):
     """Renders the enhanced result page with previews."""
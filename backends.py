@@ -0,0 +1,108 @@
+"""
+Inference backends for the Wav2Lip generator.
+
+'torch' runs the TorchScript checkpoint (see inference2.load_model).
+'onnxruntime' runs graphs written by export_onnx.py on ONNX Runtime's CPU
+execution provider. onnxruntime (and onnx, for the export) are optional
+dependencies listed in requirements-onnx.txt and are only imported when that
+backend is used.
+"""
+import importlib.util
+import os
+import threading
+from typing import Dict, List, Optional
+import logging
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('torch', 'onnxruntime')
+
+# Wav2Lip graphs written by export_onnx.py next to the checkpoint: the full
+# forward pass plus the three stages used by the still-image / looped-video paths
+WAV2LIP_GRAPHS = ('forward', 'encode_face', 'encode_audio', 'decode')
+
+ort_num_threads = int(os.environ.get('ORT_NUM_THREADS', 0))
+
+def require_onnx(*packages):
+    """Raises a RuntimeError naming the optional ONNX packages that are not installed"""
+    missing = [name for name in packages if importlib.util.find_spec(name) is None]
+    if missing:
+        raise RuntimeError(f"The 'onnxruntime' backend needs {' and '.join(missing)}: "
+                           f"pip install -r requirements-onnx.txt")
+
+def check_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unsupported backend '{backend}'. Choose one of: {', '.join(BACKENDS)}")
+    if backend == 'onnxruntime':
+        require_onnx('onnxruntime')
+
+def onnx_graph_path(checkpoint_path: str, graph: str = 'forward') -> str:
+    """Where export_onnx.py writes one Wav2Lip graph of a checkpoint"""
+    stem = os.path.splitext(checkpoint_path)[0]
+    return f'{stem}.onnx' if graph == 'forward' else f'{stem}.{graph}.onnx'
+
+def create_session(path: str, num_threads: Optional[int] = None):
+    """ONNX Runtime session on the CPU execution provider with all graph optimizations enabled"""
+    require_onnx('onnxruntime')
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    num_threads = ort_num_threads if num_threads is None else num_threads
+    if num_threads > 0:
+        options.intra_op_num_threads = num_threads
+    return ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+
+def _to_numpy(tensor: torch.Tensor) -> np.ndarray:
+    return np.ascontiguousarray(tensor.detach().cpu().float().numpy())
+
+class OnnxWav2Lip:
+    """
+    ONNX Runtime Wav2Lip exposing the same call signature and
+    encode_face / encode_audio / decode methods as the TorchScript model.
+    Inputs and outputs are CPU torch tensors. The stage graphs are only
+    loaded when a stage method is first used.
+    """
+
+    def __init__(self, path: str):
+        # path is the forward graph; the stage graphs are its siblings
+        self.path = path
+        self._sessions: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self._session('forward')
+
+    def _session(self, graph):
+        # The model is shared by concurrent jobs; sessions themselves are thread-safe
+        with self._lock:
+            if graph in self._sessions:
+                return self._sessions[graph]
+            path = onnx_graph_path(self.path, graph)
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"ONNX graph not found at {path}; re-run export_onnx.py for this checkpoint")
+            logger.info(f"Loading ONNX Runtime session from {path}")
+            self._sessions[graph] = create_session(path)
+            return self._sessions[graph]
+
+    def _run(self, graph, *inputs):
+        session = self._session(graph)
+        feeds = {arg.name: _to_numpy(x) for arg, x in zip(session.get_inputs(), inputs)}
+        return [torch.from_numpy(y) for y in session.run(None, feeds)]
+
+    def encode_face(self, face_sequences) -> List[torch.Tensor]:
+        return self._run('encode_face', face_sequences)
+
+    def encode_audio(self, audio_sequences):
+        return self._run('encode_audio', audio_sequences)[0]
+
+    def decode(self, audio_embedding, feats: List[torch.Tensor]):
+        return self._run('decode', audio_embedding, *feats)[0]
+
+    def __call__(self, audio_sequences, face_sequences):
+        return self._run('forward', audio_sequences, face_sequences)[0]
+
+def load_onnx_wav2lip(path: str) -> OnnxWav2Lip:
+    print("Loading ONNX Runtime model from:", path)
+    return OnnxWav2Lip(path)
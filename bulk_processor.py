@@ -4,6 +4,7 @@ import json
 import uuid
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from queue import Queue, Empty
 from typing import Dict, List, Optional, Tuple
@@ -12,9 +13,10 @@ import logging
 logger = logging.getLogger(__name__)
 
 class BulkProcessor:
-    def __init__(self, results_folder: str, temp_folder: str):
+    def __init__(self, results_folder: str, temp_folder: str, max_workers: int = 1):
         self.results_folder = results_folder
         self.temp_folder = temp_folder
+        self.max_workers = max(1, max_workers)
         self.job_queue = Queue()
         self.active_jobs = {}
         self.completed_jobs = {}
@@ -111,31 +113,52 @@ class BulkProcessor:
             model_path = job_data['config']['model_path']
             settings = job_data['config'].get('settings', {})
             
-            for i, (face_file, audio_file) in enumerate(file_pairs):
+            # Load the model once here, before the workers start, so they all find the resident
+            # copy instead of racing to load it
+            import inference2
+            try:
+                inference2.get_model(model_path, settings.get('memory_format', 'contiguous'),
+                                     settings.get('backend', 'torch'), settings.get('precision', 'fp32'))
+            except Exception as e:
+                # Each file pair loads the model itself and reports its own failure
+                logger.warning(f"Could not preload model for job {job_id}: {e}")
+            
+            def run_pair(i, face_file, audio_file):
                 if job_data['status'] == 'cancelled':
-                    break
-                
+                    return None
                 try:
                     # Process individual file pair
-                    result = self._process_file_pair(
+                    return self._process_file_pair(
                         face_file, audio_file, model_path, settings, job_id, i
                     )
-                    job_data['results'].append(result)
-                    job_data['processed_files'] += 1
-                    
                 except Exception as e:
                     logger.error(f"Failed to process file pair {i} in job {job_id}: {e}")
-                    job_data['failed_files'] += 1
-                    job_data['results'].append({
+                    return {
                         'index': i,
                         'face_file': face_file,
                         'audio_file': audio_file,
                         'status': 'failed',
                         'error': str(e)
-                    })
+                    }
+            
+            # Each inference runs in its own workspace, so file pairs can be processed in parallel
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [executor.submit(run_pair, i, face_file, audio_file)
+                           for i, (face_file, audio_file) in enumerate(file_pairs)]
                 
-                # Update progress
-                job_data['progress'] = int((i + 1) / len(file_pairs) * 100)
+                for done, future in enumerate(as_completed(futures), start=1):
+                    result = future.result()
+                    if result is not None:
+                        if result['status'] == 'success':
+                            job_data['processed_files'] += 1
+                        else:
+                            job_data['failed_files'] += 1
+                        job_data['results'].append(result)
+                    
+                    # Update progress
+                    job_data['progress'] = int(done / len(file_pairs) * 100)
+            
+            job_data['results'].sort(key=lambda r: r['index'])
             
             # Mark job as completed or failed
             if job_data['status'] != 'cancelled':
@@ -181,7 +204,21 @@ class BulkProcessor:
                 box=settings.get('box', [-1, -1, -1, -1]),
                 face_det_batch_size=settings.get('face_det_batch_size', 8),
                 wav2lip_batch_size=settings.get('wav2lip_batch_size', 64),
-                img_size=settings.get('img_size', 96)
+                img_size=settings.get('img_size', 96),
+                video_codec=settings.get('video_codec', 'libx264'),
+                encoder_preset=settings.get('encoder_preset', 'veryfast'),
+                crf=settings.get('crf', 20),
+                encoder_threads=settings.get('encoder_threads', 0),
+                precision=settings.get('precision', 'fp32'),
+                memory_format=settings.get('memory_format', 'contiguous'),
+                backend=settings.get('backend', 'torch'),
+                detect_every=settings.get('detect_every', 1),
+                detect_scale=settings.get('detect_scale', 1),
+                box_smoothing=settings.get('box_smoothing', 'mean'),
+                track_faces=settings.get('track_faces', False),
+                face_detector=settings.get('face_detector', 'sfd'),
+                temp_dir=self.temp_folder,
+                output_dir=self.results_folder
             )
             
             return {
@@ -200,10 +237,10 @@ class BulkProcessor:
 # Global bulk processor instance
 bulk_processor = None
 
-def get_bulk_processor(results_folder: str, temp_folder: str) -> BulkProcessor:
+def get_bulk_processor(results_folder: str, temp_folder: str, max_workers: int = 1) -> BulkProcessor:
     """Get or create the global bulk processor instance"""
     global bulk_processor
     if bulk_processor is None:
-        bulk_processor = BulkProcessor(results_folder, temp_folder)
+        bulk_processor = BulkProcessor(results_folder, temp_folder, max_workers)
         bulk_processor.start_worker()
     return bulk_processor
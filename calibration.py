@@ -0,0 +1,446 @@
+"""
+Per-host calibration of face_det_batch_size and wav2lip_batch_size.
+
+For each input resolution bucket this measures the throughput and peak memory
+of S3FD detection and of a Wav2Lip batch (model plus compositing) over a range
+of batch sizes. It then stores the fastest batch size that fits the memory
+budget in config/calibration.json. Presets that set a batch size to "auto" use
+the stored value for the job's resolution. Batch sizes that ran out of memory
+during a job are also remembered, so later "auto" jobs start below them.
+
+    python calibration.py --checkpoint_path checkpoints/Wav2Lip-SD-GAN.pt --resolutions 720 1080
+
+Results are keyed by a hardware fingerprint, so hosts of different instance
+types can share one config folder.
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Optional, Sequence, Tuple
+import logging
+
+import numpy as np
+import torch
+
+try:
+    import fcntl
+except ImportError:  # Windows: updates are only serialized within a process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Buckets are keyed by the short side of the (preprocessed) input frame
+RESOLUTION_BUCKETS = (360, 480, 720, 1080, 1440, 2160)
+FACE_DET_BATCH_SIZES = (1, 2, 4, 8, 16, 32)
+WAV2LIP_BATCH_SIZES = (16, 32, 64, 128, 256)
+BATCH_SETTINGS = ('face_det_batch_size', 'wav2lip_batch_size')
+# Used for "auto" when this host has not been calibrated
+DEFAULT_BATCH_SIZES = {'face_det_batch_size': 16, 'wav2lip_batch_size': 128}
+# Among batch sizes within this fraction of the best throughput, the smallest wins
+THROUGHPUT_TOLERANCE = 0.05
+
+def resolution_bucket(frame_shape: Sequence[int]) -> int:
+    """Smallest bucket that holds the short side of an (h, w, ...) frame"""
+    short_side = min(frame_shape[0], frame_shape[1])
+    for bucket in RESOLUTION_BUCKETS:
+        if short_side <= bucket:
+            return bucket
+    return RESOLUTION_BUCKETS[-1]
+
+def _cpu_model():
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+def _meminfo_mb(field):
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def host_fingerprint(device: str) -> str:
+    """Identifies the hardware (not the hostname) so hosts of one instance type share results"""
+    if device == 'cuda':
+        properties = torch.cuda.get_device_properties(0)
+        accelerator = f'{properties.name} {properties.total_memory // 1024 ** 2}MB'
+    else:
+        accelerator = 'cpu'
+    memory = _meminfo_mb('MemTotal')
+    memory = f'{round(memory / 1024)}GB' if memory else 'unknown'
+    return f'{accelerator} | {_cpu_model()} x{os.cpu_count()} | {memory}'
+
+def memory_budget_mb(device: str, fraction: float) -> Optional[float]:
+    """Memory a single job may use at its peak; None if it cannot be determined"""
+    if device == 'cuda':
+        return torch.cuda.get_device_properties(0).total_memory / 1024 ** 2 * fraction
+    available = _meminfo_mb('MemAvailable')
+    return available * fraction if available else None
+
+class PeakMemory:
+    """Peak memory (MB above `baseline`, or the level on entry) of the code run inside the context.
+
+    Uses the CUDA allocator statistics on the GPU. On the CPU it resets and
+    reads the process's peak RSS (Linux only); elsewhere `peak_mb` stays None.
+    Memory freed by earlier runs usually stays in the process, so pass the
+    level from before those runs as `baseline`.
+    """
+
+    def __init__(self, device: str, baseline: Optional[int] = None):
+        self.device = device
+        self.baseline = baseline
+        self.peak_mb = None
+
+    @classmethod
+    def current(cls, device: str) -> Optional[int]:
+        """Bytes currently allocated on the GPU, or the process's RSS"""
+        if device == 'cuda':
+            return torch.cuda.memory_allocated()
+        return cls._read_status('VmRSS')
+
+    @staticmethod
+    def _read_status(field):
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith(field + ':'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    def __enter__(self):
+        if self.device == 'cuda':
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+        else:
+            try:
+                # Resets VmHWM to the current RSS
+                with open('/proc/self/clear_refs', 'w') as f:
+                    f.write('5')
+            except OSError:
+                pass
+        self._base = self.current(self.device) if self.baseline is None else self.baseline
+        return self
+
+    def __exit__(self, *exc):
+        if self.device == 'cuda':
+            torch.cuda.synchronize()
+            peak = torch.cuda.max_memory_allocated()
+        else:
+            peak = self._read_status('VmHWM')
+        if peak is not None and self._base is not None:
+            self.peak_mb = max(0., (peak - self._base) / 1024 ** 2)
+
+def _is_oom(e: BaseException) -> bool:
+    return isinstance(e, (MemoryError, torch.cuda.OutOfMemoryError)) or 'out of memory' in str(e).lower()
+
+def _sweep(run, batch_sizes, iterations, device, budget_mb):
+    """Times run(batch_size) for growing batch sizes; stops at OOM, the memory budget or a throughput drop"""
+    measurements = {}
+    best = 0.
+    baseline = PeakMemory.current(device)
+    for batch_size in batch_sizes:
+        try:
+            run(batch_size)  # warmup
+            with PeakMemory(device, baseline) as memory:
+                start = time.time()
+                for _ in range(iterations):
+                    run(batch_size)
+                if device == 'cuda':
+                    torch.cuda.synchronize()
+                elapsed = time.time() - start
+        except (RuntimeError, MemoryError) as e:
+            if not _is_oom(e):
+                raise
+            logger.info(f"Batch size {batch_size} ran out of memory")
+            if device == 'cuda':
+                torch.cuda.empty_cache()
+            break
+
+        fps = batch_size * iterations / elapsed
+        measurements[batch_size] = {'frames_per_sec': round(fps, 2), 'peak_memory_mb': memory.peak_mb}
+        logger.info(f"Batch size {batch_size}: {fps:.1f} frames/s, peak {memory.peak_mb} MB")
+        if budget_mb is not None and memory.peak_mb is not None and memory.peak_mb > budget_mb:
+            measurements[batch_size]['over_budget'] = True
+            break
+        if fps < best * (1 - 2 * THROUGHPUT_TOLERANCE):
+            break
+        best = max(best, fps)
+    return measurements
+
+def pick_batch_size(measurements: Dict) -> Optional[int]:
+    """Smallest batch size within THROUGHPUT_TOLERANCE of the best throughput that fits the budget"""
+    candidates = {int(bs): m['frames_per_sec'] for bs, m in measurements.items() if not m.get('over_budget')}
+    if not candidates:
+        return None
+    best = max(candidates.values())
+    return min(bs for bs, fps in candidates.items() if fps >= best * (1 - THROUGHPUT_TOLERANCE))
+
+def calibrate(checkpoint_path: str, resolutions: Sequence[int] = (720, 1080), iterations: int = 3,
+              memory_fraction: float = 0.5, precision: str = 'fp32', memory_format: str = 'contiguous',
+              backend: str = 'torch', face_det_batch_sizes: Sequence[int] = FACE_DET_BATCH_SIZES,
+              wav2lip_batch_sizes: Sequence[int] = WAV2LIP_BATCH_SIZES) -> Dict[str, Dict]:
+    """
+    Measures detection and Wav2Lip batches at each resolution (short side, 16:9
+    frames) and returns {bucket: {setting: batch size, 'measurements': ...}}.
+    """
+    import face_detection
+    import inference2
+
+    inference2.check_inference_mode(precision, memory_format)
+    device = inference2.device
+    budget_mb = memory_budget_mb(device, memory_fraction)
+    model = inference2.get_model(checkpoint_path, memory_format, backend, precision)
+    run_device = inference2.model_device(model)
+    input_format = torch.channels_last if memory_format == 'channels_last' else torch.contiguous_format
+    rng = np.random.RandomState(0)
+
+    results = {}
+    for resolution in resolutions:
+        h, w = resolution, int(round(resolution * 16 / 9)) // 2 * 2
+        bucket = resolution_bucket((h, w))
+        logger.info(f"Calibrating {w}x{h} (bucket {bucket}) on {device}")
+
+        frames = rng.randint(0, 256, (max(face_det_batch_sizes), h, w, 3), dtype=np.uint8)
+
+        def detect(batch_size):
+            with face_detection.get_detector_pool(size=inference2.detector_pool_size,
+                                                  backend=backend).acquire(device) as detector:
+                detector.get_detections_for_batch(frames[:batch_size])
+
+        # A face box of a third of the frame height in the middle of the frame
+        side = h // 3
+        y1, x1 = (h - side) // 2, (w - side) // 2
+        box = (y1, y1 + side, x1, x1 + side)
+
+        def wav2lip(batch_size):
+            img = torch.rand(batch_size, 6, 96, 96).to(run_device, memory_format=input_format)
+            mel = torch.randn(batch_size, 1, 80, 16).to(run_device, memory_format=input_format)
+            with torch.no_grad(), inference2.inference_context(precision):
+                pred = model(mel, img)
+            # The full-resolution frames of a batch are part of its memory cost
+            frame_batch = np.repeat(frames[:1], batch_size, axis=0)
+            coords = [box] * batch_size
+            patches = inference2.resize_predictions(pred.float(), coords)
+            inference2.paste_predictions(frame_batch, patches, coords)
+
+        detection = _sweep(detect, face_det_batch_sizes, iterations, device, budget_mb)
+        generation = _sweep(wav2lip, wav2lip_batch_sizes, iterations, device, budget_mb)
+        results[str(bucket)] = {
+            'face_det_batch_size': pick_batch_size(detection),
+            'wav2lip_batch_size': pick_batch_size(generation),
+            'resolution': [w, h],
+            'measurements': {'face_det_batch_size': detection, 'wav2lip_batch_size': generation}
+        }
+    return results
+
+def read_calibration(path: str) -> Dict:
+    """Stored calibration results; empty if the file does not exist or cannot be read"""
+    try:
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                return json.load(f)
+    except Exception as e:
+        logger.error(f"Error loading calibration: {e}")
+    return {}
+
+@contextmanager
+def _file_lock(path):
+    with open(path + '.lock', 'a') as lock_file:
+        if fcntl is not None:
+            # Released when the file is closed
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+def update_calibration(path: str, update: Callable[[Dict], None]):
+    """
+    Applies update to the stored calibration in place and saves it. The file
+    is re-read under an exclusive file lock, so processes sharing the config
+    folder (app workers, bulk jobs) do not overwrite each other, and replaced
+    in one step, so readers never see a partial write.
+    """
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with _file_lock(path):
+            calibration = read_calibration(path)
+            update(calibration)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='calibration.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(calibration, f, indent=2)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+    except Exception as e:
+        logger.error(f"Error saving calibration: {e}")
+
+class HostCalibration:
+    """Calibrated and OOM-learned batch sizes of this host, stored in calibration_file"""
+
+    def __init__(self, calibration_file: str, device: str):
+        self.calibration_file = calibration_file
+        self.device = device
+        self.host = host_fingerprint(device)
+        self._lock = threading.RLock()
+        self._thread = None
+        self.status = 'idle'
+        self.error = None
+
+    def _host_data(self) -> Dict:
+        return read_calibration(self.calibration_file).get('hosts', {}).get(self.host, {})
+
+    def _update(self, update):
+        with self._lock:
+            update_calibration(self.calibration_file,
+                               lambda calibration: update(calibration.setdefault('hosts', {}).setdefault(self.host, {})))
+
+    def limits(self) -> Dict:
+        """The learned limits of this host, {bucket: {setting: batch size}}; read once per job"""
+        return self._host_data().get('limits', {})
+
+    def limit(self, setting: str, frame_shape: Sequence[int], batch_size: int,
+              limits: Optional[Dict] = None) -> int:
+        """
+        Caps a batch size at the largest size that did not run out of memory at
+        this resolution. limits is a snapshot from limits(); without one the
+        calibration file is read.
+        """
+        limits = self.limits() if limits is None else limits
+        limit = limits.get(str(resolution_bucket(frame_shape)), {}).get(setting)
+        return min(batch_size, limit) if limit else batch_size
+
+    def record_limit(self, setting: str, frame_shape: Sequence[int], batch_size: int):
+        """Remember a batch size that a job had to fall back to after running out of memory"""
+        bucket = str(resolution_bucket(frame_shape))
+
+        def update(host_data):
+            limits = host_data.setdefault('limits', {}).setdefault(bucket, {})
+            limits[setting] = min(batch_size, limits.get(setting, batch_size))
+        self._update(update)
+        logger.info(f"Limiting {setting} to {batch_size} for {bucket}p inputs on this host")
+
+    def batch_sizes(self, frame_shape: Sequence[int]) -> Dict[str, int]:
+        """Calibrated batch sizes for a frame shape, falling back to the nearest calibrated bucket"""
+        buckets = self._host_data().get('buckets', {})
+        bucket = resolution_bucket(frame_shape)
+        calibrated = sorted(int(b) for b in buckets)
+        if not calibrated:
+            return {}
+        # Prefer the next larger calibrated bucket: its batch sizes also fit in memory here
+        larger = [b for b in calibrated if b >= bucket]
+        return {k: v for k, v in buckets[str(larger[0] if larger else calibrated[-1])].items()
+                if k in BATCH_SETTINGS and v}
+
+    def resolve(self, face_det_batch_size, wav2lip_batch_size, frame_shape: Sequence[int],
+                limits: Optional[Dict] = None) -> Tuple[int, int]:
+        """Replaces "auto" batch sizes with calibrated values for this frame shape"""
+        limits = self.limits() if limits is None else limits
+        calibrated = self.batch_sizes(frame_shape)
+        resolved = []
+        for setting, value in zip(BATCH_SETTINGS, (face_det_batch_size, wav2lip_batch_size)):
+            if value == 'auto':
+                if setting not in calibrated:
+                    logger.warning(f"No calibration for {setting} on this host; using "
+                                   f"{DEFAULT_BATCH_SIZES[setting]}. Run calibration.py or POST /calibration.")
+                value = calibrated.get(setting, DEFAULT_BATCH_SIZES[setting])
+            resolved.append(self.limit(setting, frame_shape, int(value), limits))
+        return tuple(resolved)
+
+    def run(self, checkpoint_path: str, resolutions: Sequence[int], **kwargs) -> Dict:
+        """Calibrates and stores the results for this host"""
+        results = calibrate(checkpoint_path, resolutions, **kwargs)
+
+        def update(host_data):
+            host_data.setdefault('buckets', {}).update(results)
+            # New measurements supersede limits learned from OOMs at these resolutions
+            for bucket in results:
+                host_data.get('limits', {}).pop(bucket, None)
+            host_data['device'] = self.device
+            host_data['checkpoint'] = os.path.basename(checkpoint_path)
+            host_data['calibrated_at'] = datetime.now().isoformat()
+        self._update(update)
+        return results
+
+    def start(self, checkpoint_path: str, resolutions: Sequence[int], **kwargs) -> bool:
+        """Runs calibration on a background thread; returns False if one is already running"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self.status, self.error = 'running', None
+
+            def target():
+                try:
+                    self.run(checkpoint_path, resolutions, **kwargs)
+                    self.status = 'completed'
+                except Exception as e:
+                    logger.error(f"Calibration failed: {e}")
+                    self.status, self.error = 'failed', str(e)
+
+            self._thread = threading.Thread(target=target, name='calibration', daemon=True)
+            self._thread.start()
+            return True
+
+    def clear(self):
+        """Forget this host's calibration and learned limits"""
+        self._update(lambda host_data: host_data.clear())
+
+    def get_stats(self) -> Dict:
+        """Get calibration status and stored results for this host"""
+        return {'host': self.host, 'status': self.status, 'error': self.error, **self._host_data()}
+
+# Global calibration instance
+host_calibration = None
+
+def get_host_calibration(config_folder: Optional[str] = None, device: Optional[str] = None) -> HostCalibration:
+    """Get or create the calibration store of this host"""
+    global host_calibration
+    if host_calibration is None:
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        config_folder = config_folder or os.environ.get('CONFIG_FOLDER', 'config')
+        # Nothing is written until a calibration or an OOM limit is stored
+        host_calibration = HostCalibration(os.path.join(config_folder, 'calibration.json'), device)
+    return host_calibration
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibrate face detection and Wav2Lip batch sizes for this host')
+    parser.add_argument('--checkpoint_path', type=str, help='Wav2Lip checkpoint to calibrate with', required=True)
+    parser.add_argument('--resolutions', nargs='+', type=int, default=[720, 1080],
+                        help='Short side of the calibrated input frames')
+    parser.add_argument('--iterations', type=int, default=3, help='Timed batches per batch size')
+    parser.add_argument('--memory_fraction', type=float, default=0.5,
+                        help='Share of host (or GPU) memory one job may use at its peak')
+    parser.add_argument('--precision', type=str, default='fp32')
+    parser.add_argument('--memory_format', type=str, default='contiguous')
+    parser.add_argument('--backend', type=str, default='torch')
+    parser.add_argument('--config_folder', type=str, default='config')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    calibration = get_host_calibration(args.config_folder)
+    results = calibration.run(args.checkpoint_path, args.resolutions, iterations=args.iterations,
+                              memory_fraction=args.memory_fraction, precision=args.precision,
+                              memory_format=args.memory_format, backend=args.backend)
+    print(f"Host: {calibration.host}")
+    for bucket, result in results.items():
+        print(f"  {bucket}p: face_det_batch_size={result['face_det_batch_size']}, "
+              f"wav2lip_batch_size={result['wav2lip_batch_size']}")
+
+if __name__ == '__main__':
+    main()
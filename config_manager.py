@@ -35,7 +35,19 @@ class ConfigManager:
                     'pads': [0, 10, 0, 0],
                     'nosmooth': False,
                     'static': False,
-                    'rotate': False
+                    'rotate': False,
+                    'video_codec': 'libx264',
+                    'encoder_preset': 'medium',
+                    'crf': 18,
+                    'encoder_threads': 0,
+                    'precision': 'fp32',
+                    'memory_format': 'contiguous',
+                    'backend': 'torch',
+                    'detect_every': 1,
+                    'detect_scale': 1,
+                    'box_smoothing': 'mean',
+                    'track_faces': False,
+                    'face_detector': 'sfd'
                 }
             },
             'fast_processing': {
@@ -50,7 +62,19 @@ class ConfigManager:
                     'pads': [0, 10, 0, 0],
                     'nosmooth': False,
                     'static': False,
-                    'rotate': False
+                    'rotate': False,
+                    'video_codec': 'libx264',
+                    'encoder_preset': 'veryfast',
+                    'crf': 23,
+                    'encoder_threads': 0,
+                    'precision': 'fp32',
+                    'memory_format': 'channels_last',
+                    'backend': 'torch',
+                    'detect_every': 5,
+                    'detect_scale': 'auto',
+                    'box_smoothing': 'mean',
+                    'track_faces': True,
+                    'face_detector': 'sfd'
                 }
             },
             'mobile_optimized': {
@@ -65,7 +89,19 @@ class ConfigManager:
                     'pads': [0, 15, 0, 0],
                     'nosmooth': False,
                     'static': False,
-                    'rotate': False
+                    'rotate': False,
+                    'video_codec': 'libx264',
+                    'encoder_preset': 'veryfast',
+                    'crf': 26,
+                    'encoder_threads': 0,
+                    'precision': 'fp32',
+                    'memory_format': 'channels_last',
+                    'backend': 'torch',
+                    'detect_every': 5,
+                    'detect_scale': 'auto',
+                    'box_smoothing': 'mean',
+                    'track_faces': True,
+                    'face_detector': 'sfd'
                 }
             },
             'portrait_mode': {
@@ -80,7 +116,19 @@ class ConfigManager:
                     'pads': [0, 20, 0, 0],
                     'nosmooth': False,
                     'static': False,
-                    'rotate': False
+                    'rotate': False,
+                    'video_codec': 'libx264',
+                    'encoder_preset': 'fast',
+                    'crf': 20,
+                    'encoder_threads': 0,
+                    'precision': 'fp32',
+                    'memory_format': 'contiguous',
+                    'backend': 'torch',
+                    'detect_every': 1,
+                    'detect_scale': 'auto',
+                    'box_smoothing': 'mean',
+                    'track_faces': False,
+                    'face_detector': 'sfd'
                 }
             },
             'batch_processing': {
@@ -89,13 +137,25 @@ class ConfigManager:
                 'settings': {
                     'fps': 25.0,
                     'resize_factor': 2,
-                    'face_det_batch_size': 16,
-                    'wav2lip_batch_size': 128,
+                    'face_det_batch_size': 'auto',
+                    'wav2lip_batch_size': 'auto',
                     'img_size': 96,
                     'pads': [0, 10, 0, 0],
                     'nosmooth': True,
                     'static': False,
-                    'rotate': False
+                    'rotate': False,
+                    'video_codec': 'libx264',
+                    'encoder_preset': 'veryfast',
+                    'crf': 23,
+                    'encoder_threads': 0,
+                    'precision': 'fp32',
+                    'memory_format': 'channels_last',
+                    'backend': 'torch',
+                    'detect_every': 5,
+                    'detect_scale': 'auto',
+                    'box_smoothing': 'mean',
+                    'track_faces': True,
+                    'face_detector': 'sfd'
                 }
             }
         }
@@ -221,7 +281,7 @@ class ConfigManager:
         }
     
     def get_micro_change_templates(self) -> Dict:
-        """Get templates for micro-changes"""
+        """Get templates for micro-changes; allow_auto parameters also take 'auto' (see calibration.py)"""
         return {
             'lip_sync_strength': {
                 'name': 'Lip Sync Strength',
@@ -231,7 +291,8 @@ class ConfigManager:
                 'max_value': 128,
                 'default_value': 64,
                 'step': 16,
-                'impact': 'Higher values = stronger sync, longer processing'
+                'impact': 'Higher values = stronger sync, longer processing',
+                'allow_auto': True
             },
             'face_detection_sensitivity': {
                 'name': 'Face Detection Sensitivity',
@@ -241,7 +302,8 @@ class ConfigManager:
                 'max_value': 32,
                 'default_value': 8,
                 'step': 2,
-                'impact': 'Lower values = more sensitive detection'
+                'impact': 'Lower values = more sensitive detection',
+                'allow_auto': True
             },
             'output_quality': {
                 'name': 'Output Quality',
@@ -285,6 +347,12 @@ class ConfigManager:
                 template = templates[change_id]
                 parameter = template['parameter']
                 
+                if value == 'auto':
+                    # Leave the batch size to this host's calibration
+                    if template.get('allow_auto'):
+                        result_settings[parameter] = 'auto'
+                    continue
+                
                 # Validate value range
                 min_val = template['min_value']
                 max_val = template['max_value']
@@ -301,6 +369,9 @@ class ConfigManager:
                 else:
                     # Handle scalar parameters
                     validated_value = max(min_val, min(max_val, value))
+                    if isinstance(template['default_value'], int):
+                        # Form values arrive as floats; batch sizes and factors must stay integers
+                        validated_value = int(round(validated_value))
                     result_settings[parameter] = validated_value
         
         return result_settings
@@ -9,6 +9,7 @@ import torch
 sys.path.append('../')
 import audio
 import face_detection
+from face_boxes import pad_boxes, smooth_boxes
 from models import Wav2Lip
 
 parser = argparse.ArgumentParser(description='Code to generate results on ReSyncED evaluation set')
@@ -39,16 +40,7 @@ parser.add_argument('--max_frame_res', help='Downsample to at least this frame r
 args = parser.parse_args()
 args.img_size = 96
 
-def get_smoothened_boxes(boxes, T):
-	for i in range(len(boxes)):
-		if i + T > len(boxes):
-			window = boxes[len(boxes) - T:]
-		else:
-			window = boxes[i : i + T]
-		boxes[i] = np.mean(window, axis=0)
-	return boxes
-
-def rescale_frames(images):
+def rescale_frames(images, detector):
 	rect = detector.get_detections_for_batch(np.array([images[0]]))[0]
 	if rect is None:
 		raise ValueError('Face not detected!')
@@ -72,35 +64,27 @@ def rescale_frames(images):
 
 def face_detect(images):
 	batch_size = args.face_det_batch_size
-	images = rescale_frames(images)
 
-	while 1:
-		predictions = []
-		try:
-			for i in range(0, len(images), batch_size):
-				predictions.extend(detector.get_detections_for_batch(np.array(images[i:i + batch_size])))
-		except RuntimeError:
-			if batch_size == 1:
-				raise RuntimeError('Image too big to run face detection on GPU')
-			batch_size //= 2
-			print('Recovering from OOM error; New batch size: {}'.format(batch_size))
-			continue
-		break
-
-	results = []
-	pady1, pady2, padx1, padx2 = args.pads
-	for rect, image in zip(predictions, images):
-		if rect is None:
-			raise ValueError('Face not detected!')
-
-		y1 = max(0, rect[1] - pady1)
-		y2 = min(image.shape[0], rect[3] + pady2)
-		x1 = max(0, rect[0] - padx1)
-		x2 = min(image.shape[1], rect[2] + padx2)
-		
-		results.append([x1, y1, x2, y2])
-
-	boxes = get_smoothened_boxes(np.array(results), T=5)
+	with detector_pool.acquire(device) as detector:
+		images = rescale_frames(images, detector)
+
+		while 1:
+			predictions = []
+			try:
+				for i in range(0, len(images), batch_size):
+					predictions.extend(detector.get_detections_for_batch(np.array(images[i:i + batch_size])))
+			except RuntimeError:
+				if batch_size == 1:
+					raise RuntimeError('Image too big to run face detection on GPU')
+				batch_size //= 2
+				print('Recovering from OOM error; New batch size: {}'.format(batch_size))
+				continue
+			break
+
+	if any(rect is None for rect in predictions):
+		raise ValueError('Face not detected!')
+
+	boxes = smooth_boxes(pad_boxes(predictions, args.pads, images[0].shape), T=5)
 	results = [[image[y1: y2, x1:x2], (y1, y2, x1, x2), True] for image, (x1, y1, x2, y2) in zip(images, boxes)]
 
 	return results, images 
@@ -170,8 +154,7 @@ mel_step_size = 16
 device = 'cuda' if torch.cuda.is_available() else 'cpu'
 print('Using {} for inference.'.format(device))
 
-detector = face_detection.FaceAlignment(face_detection.LandmarksType._2D, 
-											flip_input=False, device=device)
+detector_pool = face_detection.get_detector_pool()
 
 def _load(checkpoint_path):
 	if device == 'cuda':
@@ -0,0 +1,73 @@
+"""
+Exports an inference-only TorchScript artifact with BatchNorm folded into every
+models/conv.py convolution and the graph frozen. When inference2 loads the
+artifact it also runs torch.jit.optimize_for_inference, which fuses the ReLUs
+and residual adds into the convolutions. That pass produces backend-specific
+constants that cannot be serialized, so it is not run at export time.
+
+    python export_fused.py --checkpoint_path checkpoints/Wav2Lip-SD-GAN.pt
+
+For Wav2Lip the default output is the sibling file that inference2 picks up
+automatically: <checkpoint>.fused.pt on the CPU, <checkpoint>.fused.cuda.pt on
+CUDA. A frozen graph has its weights baked in as constants, so it only runs on
+the device it was exported for. --arch syncnet exports SyncNet_color the same
+way, for evaluation.
+"""
+import argparse
+import json
+import os
+
+import torch
+
+import inference2
+from models import SyncNet_color, Wav2Lip, fuse_for_inference, load_eager
+
+parser = argparse.ArgumentParser(description='Export a BatchNorm-folded, frozen TorchScript model for inference')
+
+parser.add_argument('--checkpoint_path', type=str, help='Scripted or training checkpoint', required=True)
+parser.add_argument('--output', type=str, default=None,
+                    help='Output path (default: the fused sibling path inference2 looks for)')
+parser.add_argument('--arch', type=str, default='wav2lip', choices=['wav2lip', 'syncnet'])
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu',
+                    choices=['cpu', 'cuda'], help='Device the artifact will run on')
+parser.add_argument('--batch_size', type=int, default=8, help='Batch size of the parity check')
+
+ARCHS = {
+    # model class, methods to keep after freezing, example (audio, face) input shapes
+    'wav2lip': (Wav2Lip, ['encode_face', 'encode_audio', 'decode'], ((1, 80, 16), (6, 96, 96))),
+    'syncnet': (SyncNet_color, [], ((1, 80, 16), (15, 48, 96))),
+}
+
+def export(model, preserved_methods):
+    scripted = torch.jit.script(model)
+    return torch.jit.freeze(scripted, preserved_attrs=preserved_methods)
+
+def main():
+    args = parser.parse_args()
+    model_cls, preserved_methods, (audio_shape, face_shape) = ARCHS[args.arch]
+    output_path = args.output or inference2.fused_checkpoint_path(args.checkpoint_path, args.device)
+
+    reference = load_eager(args.checkpoint_path, model_cls).to(args.device)
+    fused = fuse_for_inference(load_eager(args.checkpoint_path, model_cls)).to(args.device)
+    with torch.no_grad():
+        artifact = export(fused, preserved_methods)
+
+    meta = {'fused': True, 'arch': args.arch, 'device': args.device, 'methods': preserved_methods,
+            'source': os.path.basename(args.checkpoint_path)}
+    torch.jit.save(artifact, output_path, _extra_files={inference2.MODEL_META_FILE: json.dumps(meta)})
+    print(f"Saved fused {args.arch} model to {output_path}")
+
+    # Parity check on random inputs against the unfused eager model
+    artifact = inference2.load_model(output_path) if args.arch == 'wav2lip' else torch.jit.load(output_path)
+    audio = torch.randn(args.batch_size, *audio_shape, device=args.device)
+    face = torch.rand(args.batch_size, *face_shape, device=args.device)
+    with torch.no_grad():
+        expected, actual = reference(audio, face), artifact(audio, face)
+    if isinstance(expected, tuple):
+        delta = max((e - a).abs().max().item() for e, a in zip(expected, actual))
+    else:
+        delta = (expected - actual).abs().max().item()
+    print(f"Max abs difference vs. unfused model: {delta:.2e}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Exports Wav2Lip or the S3FD face detector to ONNX for the 'onnxruntime'
+inference backend, then checks ONNX Runtime against PyTorch on fixed inputs.
+
+    python export_onnx.py --checkpoint_path checkpoints/Wav2Lip-SD-GAN.pt
+    python export_onnx.py --arch s3fd
+
+Wav2Lip is written as four graphs next to the checkpoint: <checkpoint>.onnx
+(the full forward pass) plus <checkpoint>.encode_face.onnx,
+.encode_audio.onnx and .decode.onnx for the still-image and looped-video
+paths. S3FD is written to face_detection/detection/sfd/s3fd.onnx, where
+SFDDetector looks for it. The batch dimension (and for S3FD the image size)
+stays dynamic. Pass --check to only rerun the parity check; the exit status
+is 1 if any output differs by more than --atol.
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import torch
+from torch.utils.model_zoo import load_url
+
+from backends import WAV2LIP_GRAPHS, create_session, onnx_graph_path, require_onnx
+from face_detection.detection.sfd.net_s3fd import s3fd
+from models import Wav2Lip, Wav2LipAudioEncoder, Wav2LipDecoder, Wav2LipFaceEncoder, load_eager
+
+S3FD_WEIGHTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'face_detection', 'detection', 'sfd', 's3fd.pth')
+S3FD_URL = 'https://www.adrianbulat.com/downloads/python-fan/s3fd-619a316812.pth'
+
+parser = argparse.ArgumentParser(description='Export Wav2Lip or S3FD to ONNX and check it against PyTorch')
+
+parser.add_argument('--arch', type=str, default='wav2lip', choices=['wav2lip', 's3fd'])
+parser.add_argument('--checkpoint_path', type=str, default=None,
+                    help='Wav2Lip checkpoint (scripted or training), or S3FD weights (default: the bundled s3fd.pth)')
+parser.add_argument('--opset', type=int, default=17)
+parser.add_argument('--check', action='store_true', help='Skip the export and only run the parity check')
+parser.add_argument('--batch_size', type=int, default=4, help='Batch size of the parity check')
+parser.add_argument('--atol', type=float, default=1e-3, help='Max allowed abs difference in the parity check')
+
+NUM_SKIP_FEATURES = 7
+# Per-sample input shapes of the parity check; S3FD is checked at a non-square size
+AUDIO_SHAPE, FACE_SHAPE, S3FD_SHAPE = (1, 80, 16), (6, 96, 96), (3, 240, 320)
+
+def wav2lip_graphs(model):
+    """(name, module, input names, output names, example inputs) of every exported Wav2Lip graph"""
+    audio = torch.randn(2, *AUDIO_SHAPE)
+    face = torch.rand(2, *FACE_SHAPE)
+    with torch.no_grad():
+        feats = model.encode_face(face)
+        embedding = model.encode_audio(audio)
+    feat_names = [f'feat{i}' for i in range(NUM_SKIP_FEATURES)]
+    # The wrappers must be in eval mode too: export restores each module's mode, which would put
+    # the shared submodules back into training mode
+    return {
+        'forward': (model, ['audio', 'face'], ['output'], (audio, face)),
+        'encode_face': (Wav2LipFaceEncoder(model).eval(), ['face'], feat_names, (face,)),
+        'encode_audio': (Wav2LipAudioEncoder(model).eval(), ['audio'], ['embedding'], (audio,)),
+        'decode': (Wav2LipDecoder(model).eval(), ['embedding'] + feat_names, ['output'], (embedding, *feats)),
+    }
+
+def load_s3fd(weights_path):
+    if os.path.isfile(weights_path):
+        state_dict = torch.load(weights_path, map_location='cpu')
+    else:
+        state_dict = load_url(S3FD_URL, map_location='cpu')
+    model = s3fd()
+    model.load_state_dict(state_dict)
+    return model.eval()
+
+def export_graph(module, path, input_names, output_names, example_inputs, opset, dynamic_hw=False):
+    axes = {0: 'batch', 2: 'height', 3: 'width'} if dynamic_hw else {0: 'batch'}
+    dynamic_axes = {name: axes for name in input_names + output_names}
+    with torch.no_grad():
+        # The TorchScript-based exporter handles these plain conv nets without extra dependencies
+        torch.onnx.export(module, example_inputs, path, input_names=input_names, output_names=output_names,
+                          dynamic_axes=dynamic_axes, opset_version=opset, do_constant_folding=True, dynamo=False)
+    print(f"Saved {path}")
+
+def max_difference(module, path, inputs):
+    with torch.no_grad():
+        expected = module(*inputs)
+    if isinstance(expected, torch.Tensor):
+        expected = [expected]
+    session = create_session(path)
+    actual = session.run(None, {arg.name: x.numpy() for arg, x in zip(session.get_inputs(), inputs)})
+    return max(float(np.abs(e.numpy() - a).max()) for e, a in zip(expected, actual))
+
+def main():
+    args = parser.parse_args()
+    require_onnx('onnx', 'onnxruntime')
+    torch.manual_seed(0)
+
+    if args.arch == 'wav2lip':
+        if args.checkpoint_path is None:
+            parser.error('--checkpoint_path is required for --arch wav2lip')
+        model = load_eager(args.checkpoint_path, Wav2Lip)
+        graphs = wav2lip_graphs(model)
+        targets = [(name, onnx_graph_path(args.checkpoint_path, name)) + graphs[name] for name in WAV2LIP_GRAPHS]
+        # Fixed parity inputs: seeded audio and faces, and the features they produce
+        audio = torch.randn(args.batch_size, *AUDIO_SHAPE)
+        face = torch.rand(args.batch_size, *FACE_SHAPE)
+        with torch.no_grad():
+            feats = model.encode_face(face)
+            embedding = model.encode_audio(audio)
+        check_inputs = {'forward': (audio, face), 'encode_face': (face,), 'encode_audio': (audio,),
+                        'decode': (embedding, *feats)}
+        dynamic_hw = False
+    else:
+        weights_path = args.checkpoint_path or S3FD_WEIGHTS
+        model = load_s3fd(weights_path)
+        output_names = [f'{kind}{i}' for i in range(6) for kind in ('cls', 'reg')]
+        image = torch.rand(1, *S3FD_SHAPE) * 255. - 117.
+        targets = [('s3fd', os.path.splitext(weights_path)[0] + '.onnx', model, ['image'], output_names, (image,))]
+        check_inputs = {'s3fd': (torch.rand(args.batch_size, *S3FD_SHAPE) * 255. - 117.,)}
+        dynamic_hw = True
+
+    if not args.check:
+        for name, path, module, input_names, output_names, example_inputs in targets:
+            export_graph(module, path, input_names, output_names, example_inputs, args.opset, dynamic_hw)
+
+    failed = False
+    for name, path, module, *_ in targets:
+        delta = max_difference(module, path, check_inputs[name])
+        print(f"{name}: max abs difference vs. PyTorch {delta:.2e}")
+        failed |= delta > args.atol
+    if failed:
+        print(f"Parity check failed: difference exceeds {args.atol}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Exports an inference-optimized S3FD face detector as a frozen TorchScript
+artifact. The L2Norm scales are folded into the head convolutions, the conf
+and loc heads of each level are merged, and the weights are stored
+channels_last (and optionally as bf16). SFDDetector loads the artifact
+instead of s3fd.pth when it exists next to the weights for its device; as
+with export_fused.py, the ReLU fusion of optimize_for_inference runs when it
+is loaded.
+
+    python export_s3fd.py
+    python export_s3fd.py --precision bf16
+
+The default output is <weights>.opt.pt on the CPU and <weights>.opt.cuda.pt
+on CUDA. A frozen graph only runs on the device it was exported for.
+"""
+import argparse
+import json
+import os
+
+import torch
+
+from export_onnx import S3FD_WEIGHTS, load_s3fd
+from face_detection.detection.sfd.detect import prepare_batch
+from face_detection.detection.sfd.net_s3fd import s3fd_fused
+from face_detection.detection.sfd.sfd_detector import S3FD_META_FILE, load_optimized_detector, optimized_detector_path
+
+parser = argparse.ArgumentParser(description='Export a fused, frozen S3FD face detector for inference')
+
+parser.add_argument('--checkpoint_path', type=str, default=S3FD_WEIGHTS,
+                    help='S3FD weights (default: the bundled s3fd.pth, downloaded if missing)')
+parser.add_argument('--output', type=str, default=None,
+                    help='Output path (default: the path SFDDetector looks for)')
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu',
+                    choices=['cpu', 'cuda'], help='Device the artifact will run on')
+parser.add_argument('--precision', type=str, default='fp32', choices=['fp32', 'bf16'])
+parser.add_argument('--memory_format', type=str, default='channels_last', choices=['contiguous', 'channels_last'])
+parser.add_argument('--batch_size', type=int, default=4, help='Batch size of the parity check')
+
+# Per-sample input shape of the parity check
+CHECK_SHAPE = (240, 320, 3)
+
+def export(model, precision, memory_format):
+    fused = s3fd_fused(model).eval()
+    if precision == 'bf16':
+        fused = fused.to(torch.bfloat16)
+    if memory_format == 'channels_last':
+        fused = fused.to(memory_format=torch.channels_last)
+    with torch.no_grad():
+        return torch.jit.freeze(torch.jit.script(fused))
+
+def main():
+    args = parser.parse_args()
+    output_path = args.output or optimized_detector_path(args.checkpoint_path, args.device)
+
+    reference = load_s3fd(args.checkpoint_path).to(args.device)
+    artifact = export(load_s3fd(args.checkpoint_path).to(args.device), args.precision, args.memory_format)
+
+    meta = {'arch': 's3fd', 'device': args.device, 'precision': args.precision, 'memory_format': args.memory_format,
+            'source': os.path.basename(args.checkpoint_path)}
+    torch.jit.save(artifact, output_path, _extra_files={S3FD_META_FILE: json.dumps(meta)})
+    print(f"Saved optimized s3fd to {output_path}")
+
+    # Parity check on random images against the original network, through the same input path SFDDetector uses
+    artifact, memory_format = load_optimized_detector(output_path, args.device)
+    torch.manual_seed(0)
+    images = torch.randint(0, 256, (args.batch_size,) + CHECK_SHAPE, dtype=torch.uint8).numpy()
+    with torch.no_grad():
+        expected = reference(prepare_batch(images, args.device))
+        actual = artifact(prepare_batch(images, args.device, memory_format=memory_format))
+    delta = max((e - a).abs().max().item() for e, a in zip(expected, actual))
+    print(f"Max abs difference vs. s3fd.pth: {delta:.2e}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+Face box post-processing shared by inference.py, inference2.py and the
+evaluation scripts: padding detections and clipping them to the frame, and
+temporal smoothing of a box track.
+
+Boxes are (N, 4) arrays of (x1, y1, x2, y2). Smoothing methods:
+
+'mean'      each box is the mean of itself and the next T - 1 raw boxes; the
+            last T - 1 boxes share the final window (the original behaviour,
+            computed with a cumulative sum)
+'ema'       exponential moving average with weight `alpha` on the new box
+'one_euro'  One-Euro filter (Casiez et al. 2012): smooths slow jitter
+            strongly and follows fast motion with little lag
+
+smooth_boxes works on a whole track; BoxSmoother gives the same results one
+box at a time for the streaming pipeline.
+"""
+import math
+from collections import deque
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.signal import lfilter
+
+SMOOTHING_METHODS = ('mean', 'ema', 'one_euro')
+
+def check_smoothing(method):
+    if method not in SMOOTHING_METHODS:
+        raise ValueError(f"Unsupported box smoothing '{method}'. Choose one of: {', '.join(SMOOTHING_METHODS)}")
+
+def pad_boxes(rects, pads: Sequence[int], frame_shape: Tuple[int, ...]) -> np.ndarray:
+    """Grows (N, 4) detections by pads (top, bottom, left, right) and clips them to the frame"""
+    pady1, pady2, padx1, padx2 = pads
+    h, w = frame_shape[:2]
+    boxes = np.asarray(rects, dtype=np.int64).reshape(-1, 4) + np.array([-padx1, -pady1, padx2, pady2])
+    return np.clip(boxes, 0, [w, h, w, h])
+
+def moving_average(boxes, T: int) -> np.ndarray:
+    """Forward moving average over windows of T boxes; the last T - 1 boxes share the final window"""
+    boxes = np.asarray(boxes, dtype=np.float64)
+    n = len(boxes)
+    T = min(T, n)
+    if T <= 1:
+        return boxes.copy()
+    csum = np.concatenate([np.zeros((1, boxes.shape[1])), np.cumsum(boxes, axis=0)])
+    starts = np.minimum(np.arange(n), n - T)
+    return (csum[starts + T] - csum[starts]) / T
+
+def exponential_moving_average(boxes, alpha: float = 0.5) -> np.ndarray:
+    """y[i] = alpha * x[i] + (1 - alpha) * y[i - 1], starting from the first box"""
+    boxes = np.asarray(boxes, dtype=np.float64)
+    if len(boxes) == 0:
+        return boxes.copy()
+    # y[0] = x[0]: the filter state starts as if the first box had been seen forever
+    state = (1 - alpha) * boxes[:1]
+    return lfilter([alpha], [1, alpha - 1], boxes, axis=0, zi=state)[0]
+
+class ExponentialFilter:
+    """Exponential moving average over box vectors, one box per call"""
+
+    def __init__(self, alpha: float = 0.5):
+        self.alpha = alpha
+        self.value: Optional[np.ndarray] = None
+
+    def __call__(self, box) -> np.ndarray:
+        box = np.asarray(box, dtype=np.float64)
+        self.value = box if self.value is None else self.alpha * box + (1 - self.alpha) * self.value
+        return self.value
+
+def _smoothing_factor(cutoff, rate):
+    tau = 1. / (2 * math.pi * cutoff)
+    return 1. / (1. + tau * rate)
+
+class OneEuroFilter:
+    """One-Euro filter over box vectors, one box per call"""
+
+    def __init__(self, rate: float = 25., min_cutoff: float = 1., beta: float = 0.01, d_cutoff: float = 1.):
+        self.rate = rate
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_alpha = _smoothing_factor(d_cutoff, rate)
+        self.value: Optional[np.ndarray] = None
+        self.derivative = None
+
+    def __call__(self, box) -> np.ndarray:
+        box = np.asarray(box, dtype=np.float64)
+        if self.value is None:
+            self.value, self.derivative = box, np.zeros_like(box)
+            return box
+        self.derivative = self.d_alpha * (box - self.value) * self.rate + (1 - self.d_alpha) * self.derivative
+        # Faster motion raises the cutoff, so the filter lags less when the face actually moves
+        alpha = _smoothing_factor(self.min_cutoff + self.beta * np.abs(self.derivative), self.rate)
+        self.value = alpha * box + (1 - alpha) * self.value
+        return self.value
+
+def one_euro(boxes, **filter_args) -> np.ndarray:
+    # Each output depends on the previous one through an adaptive weight, so this is inherently sequential
+    boxes = np.asarray(boxes, dtype=np.float64)
+    f = OneEuroFilter(**filter_args)
+    return np.array([f(box) for box in boxes]).reshape(boxes.shape)
+
+def smooth_boxes(boxes, T: int = 5, method: str = 'mean', **filter_args) -> np.ndarray:
+    """
+    Smooths an (N, 4) box track and returns a new int array; the input is not
+    modified. T is the window of 'mean'; filter_args go to the 'ema'
+    (alpha) and 'one_euro' (rate, min_cutoff, beta, d_cutoff) filters.
+    'mean' truncates like the original in-place version, the filters round.
+    """
+    check_smoothing(method)
+    if method == 'mean':
+        return moving_average(boxes, T).astype(np.int64)
+    if method == 'ema':
+        smoothed = exponential_moving_average(boxes, **filter_args)
+    else:
+        smoothed = one_euro(boxes, **filter_args)
+    return np.rint(smoothed).astype(np.int64)
+
+class BoxSmoother:
+    """
+    Streaming equivalent of smooth_boxes. push() takes one (item, box) and
+    yields the (item, smoothed box) pairs that are ready, flush() the rest at
+    the end of the stream. 'mean' holds back T - 1 boxes, the filters none.
+    """
+
+    def __init__(self, T: int = 5, method: str = 'mean', enabled: bool = True, **filter_args):
+        check_smoothing(method)
+        self.T = T
+        self.method = method
+        self.enabled = enabled
+        self.pending = deque()
+        # The last T raw boxes, for the final window
+        self.history = deque(maxlen=T)
+        self.sum = 0.
+        if method == 'ema':
+            self.filter = ExponentialFilter(**filter_args)
+        elif method == 'one_euro':
+            self.filter = OneEuroFilter(**filter_args)
+
+    def push(self, item, box):
+        box = np.asarray(box, dtype=np.float64)
+        if not self.enabled:
+            yield item, box.astype(np.int64)
+            return
+        if self.method != 'mean':
+            yield item, np.rint(self.filter(box)).astype(np.int64)
+            return
+        self.pending.append((item, box))
+        self.history.append(box)
+        self.sum = self.sum + box
+        if len(self.pending) >= self.T:
+            item, first = self.pending.popleft()
+            yield item, (self.sum / self.T).astype(np.int64)
+            self.sum = self.sum - first
+
+    def flush(self):
+        if not self.pending:
+            return
+        window = np.mean(list(self.history), axis=0).astype(np.int64)
+        while self.pending:
+            item, _ = self.pending.popleft()
+            yield item, window.copy()
@@ -4,4 +4,5 @@ __author__ = """Adrian Bulat"""
 __email__ = 'adrian.bulat@nottingham.ac.uk'
 __version__ = '1.0.1'
 
-from .api import FaceAlignment, LandmarksType, NetworkSize
+from .api import FACE_DETECTORS, FaceAlignment, FaceTracker, LandmarksType, NetworkSize
+from .pool import DetectorPool, get_detector_pool
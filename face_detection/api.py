@@ -43,9 +43,12 @@ class NetworkSize(Enum):
 
 ROOT = os.path.dirname(os.path.abspath(__file__))
 
+# Modules under face_detection.detection: S3FD, OpenCV's YuNet, and YuNet falling back to S3FD
+FACE_DETECTORS = ('sfd', 'yunet', 'cascade')
+
 class FaceAlignment:
     def __init__(self, landmarks_type, network_size=NetworkSize.LARGE,
-                 device='cuda', flip_input=False, face_detector='sfd', verbose=False):
+                 device='cuda', flip_input=False, face_detector='sfd', verbose=False, backend='torch'):
         self.device = device
         self.flip_input = flip_input
         self.landmarks_type = landmarks_type
@@ -57,23 +60,102 @@ class FaceAlignment:
             torch.backends.cudnn.benchmark = True
 
         # Get the face detector
+        if face_detector not in FACE_DETECTORS:
+            raise ValueError("Unsupported face detector '{}'. Choose one of: {}".format(face_detector, ', '.join(FACE_DETECTORS)))
         face_detector_module = __import__('face_detection.detection.' + face_detector,
                                           globals(), locals(), [face_detector], 0)
-        self.face_detector = face_detector_module.FaceDetector(device=device, verbose=verbose)
-
-    def get_detections_for_batch(self, images):
-        images = images[..., ::-1]
-        detected_faces = self.face_detector.detect_from_batch(images.copy())
-        results = []
-
-        for i, d in enumerate(detected_faces):
-            if len(d) == 0:
-                results.append(None)
-                continue
-            d = d[0]
-            d = np.clip(d, 0, None)
-            
-            x1, y1, x2, y2 = map(int, d[:-1])
-            results.append((x1, y1, x2, y2))
-
-        return results
\ No newline at end of file
+        self.face_detector = face_detector_module.FaceDetector(device=device, verbose=verbose, backend=backend)
+
+    def best_faces(self, images):
+        """(B, 5) best face (x1, y1, x2, y2, score) per BGR image; all zero where none was found"""
+        # S3FD takes RGB; the channel swap happens while the batch is converted to the network input
+        detected_faces = self.face_detector.detect_from_batch(images, bgr=True)
+        if detected_faces.shape[1] == 0:
+            return np.zeros((len(images), 5), dtype=np.float32)
+        return detected_faces[:, 0]
+
+    def get_detections_for_batch(self, images, tracker=None):
+        """
+        Best face rect (x1, y1, x2, y2) per image, or None. With a FaceTracker
+        the frames are treated as consecutive frames of one video: they are
+        searched only around the tracker's last face, and frames where that
+        fails are scanned in full.
+        """
+        if tracker is None:
+            best = self.best_faces(images)
+        else:
+            best = self._track(images, tracker)
+
+        rects = np.clip(best[:, :4], 0, None).astype(int)
+        return [tuple(map(int, rect)) if score > 0 else None for rect, score in zip(rects, best[:, 4])]
+
+    def _track(self, images, tracker):
+        best = np.zeros((len(images), 5), dtype=np.float32)
+        lost = np.ones(len(images), dtype=bool)
+        region = tracker.region(images.shape[1:3])
+        if region is not None:
+            x1, y1, x2, y2 = region
+            faces = self.best_faces(images[:, y1:y2, x1:x2])
+            faces[:, :4] += [x1, y1, x1, y1]
+            lost = ~tracker.accept(faces, region, images.shape[1:3])
+            best[~lost] = faces[~lost]
+        if lost.all():
+            best = self.best_faces(images)
+        elif lost.any():
+            best[lost] = self.best_faces(images[lost])
+        tracker.update(best, int(lost.sum()))
+        return best
+
+
+class FaceTracker:
+    """
+    Per-video state of FaceAlignment's tracking mode. Frames are searched
+    in the last face box grown by `margin` box sizes on every side and
+    clipped to the frame. A face found there counts only if it scores at
+    least `min_score` and does not touch the border of the search region
+    (unless that is the frame border); otherwise the frame is scanned in
+    full. Keep one tracker per job: detectors are pooled and shared
+    between jobs.
+    """
+
+    def __init__(self, margin=0.5, min_score=0.8, max_region_fraction=0.8):
+        self.margin = margin
+        self.min_score = min_score
+        # Larger regions save too little over a full scan
+        self.max_region_fraction = max_region_fraction
+        self.box = None
+        self.tracked = self.scanned = 0
+
+    def reset(self):
+        self.box = None
+
+    def region(self, frame_shape):
+        """(x1, y1, x2, y2) to search in frames of frame_shape, or None for a full scan"""
+        if self.box is None:
+            return None
+        h, w = frame_shape
+        x1, y1, x2, y2 = self.box
+        grow_x, grow_y = self.margin * (x2 - x1), self.margin * (y2 - y1)
+        x1, y1 = int(max(0, x1 - grow_x)), int(max(0, y1 - grow_y))
+        x2, y2 = int(min(w, np.ceil(x2 + grow_x))), int(min(h, np.ceil(y2 + grow_y)))
+        if x2 <= x1 or y2 <= y1 or (x2 - x1) * (y2 - y1) > self.max_region_fraction * w * h:
+            return None
+        return x1, y1, x2, y2
+
+    def accept(self, faces, region, frame_shape):
+        """Which (B, 5) faces found in region are trustworthy"""
+        h, w = frame_shape
+        x1, y1, x2, y2 = region
+        # A face cut off by the search region may be larger than what was found
+        inner = np.array([x1 if x1 > 0 else -np.inf, y1 if y1 > 0 else -np.inf,
+                          x2 if x2 < w else np.inf, y2 if y2 < h else np.inf])
+        clear = (faces[:, 0] > inner[0] + 1) & (faces[:, 1] > inner[1] + 1) & \
+                (faces[:, 2] < inner[2] - 1) & (faces[:, 3] < inner[3] - 1)
+        return (faces[:, 4] >= self.min_score) & clear
+
+    def update(self, faces, scanned):
+        self.tracked += len(faces) - scanned
+        self.scanned += scanned
+        found = np.nonzero(faces[:, 4] > 0)[0]
+        # Without a face in the last frame the next batch starts with a full scan
+        self.box = tuple(faces[-1, :4]) if len(found) and found[-1] == len(faces) - 1 else None
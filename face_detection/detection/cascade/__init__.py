@@ -0,0 +1 @@
+from .cascade_detector import CascadeDetector as FaceDetector
\ No newline at end of file
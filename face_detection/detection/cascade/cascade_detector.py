@@ -0,0 +1,71 @@
+import numpy as np
+
+from ..core import FaceDetector
+from ..sfd.sfd_detector import SFDDetector
+from ..yunet.yunet_detector import YuNetDetector
+
+
+class CascadeDetector(FaceDetector):
+    """YuNet first, S3FD only where YuNet's answer is not good enough.
+
+    A YuNet face is kept when it scores at least ``min_score``, is no
+    smaller than ``min_face_fraction`` of the frame's short side, has a
+    face-like aspect ratio and, when a second face was found, clearly beats
+    it. Every other frame of the batch goes through S3FD. Most uploads are
+    frontal talking heads, where YuNet alone is enough.
+    """
+
+    def __init__(self, device, verbose=False, backend='torch', min_score=0.8, min_face_fraction=0.05,
+                 aspect_range=(0.5, 1.5), min_margin=0.2):
+        super(CascadeDetector, self).__init__(device, verbose)
+        self.fast_detector = YuNetDetector(device, verbose=verbose)
+        self.face_detector = SFDDetector(device, verbose=verbose, backend=backend)
+        self.min_score = min_score
+        self.min_face_fraction = min_face_fraction
+        self.aspect_range = aspect_range
+        self.min_margin = min_margin
+
+    def plausible(self, faces, frame_shape):
+        """Which images' YuNet results, a (B, K, 5) array, can be used as they are"""
+        if faces.shape[1] == 0:
+            return np.zeros(len(faces), dtype=bool)
+        best = faces[:, 0]
+        width, height = best[:, 2] - best[:, 0], best[:, 3] - best[:, 1]
+        aspect = width / np.maximum(height, 1)
+        second = faces[:, 1, 4] if faces.shape[1] > 1 else np.zeros(len(faces))
+        return ((best[:, 4] >= self.min_score)
+                & (np.minimum(width, height) >= self.min_face_fraction * min(frame_shape))
+                & (aspect >= self.aspect_range[0]) & (aspect <= self.aspect_range[1])
+                & (best[:, 4] - second >= self.min_margin))
+
+    def detect_from_image(self, tensor_or_path):
+        faces = self.fast_detector.detect_from_image(tensor_or_path)
+        image = self.tensor_or_path_to_ndarray(tensor_or_path)
+        if len(faces) and self.plausible(np.array([faces]), image.shape[:2])[0]:
+            return faces
+        return self.face_detector.detect_from_image(tensor_or_path)
+
+    def detect_from_batch(self, images, bgr=False):
+        """(B, K, 5) faces scoring over 0.5 per image, best first; unused rows are all zero"""
+        faces = self.fast_detector.detect_from_batch(images, bgr)
+        retry = ~self.plausible(faces, images.shape[1:3])
+        if not retry.any():
+            return faces
+
+        slow = self.face_detector.detect_from_batch(images if retry.all() else images[retry], bgr)
+        out = np.zeros((len(images), max(faces.shape[1], slow.shape[1]), 5), dtype=np.float32)
+        out[~retry, :faces.shape[1]] = faces[~retry]
+        out[retry, :slow.shape[1]] = slow
+        return out
+
+    @property
+    def reference_scale(self):
+        return self.face_detector.reference_scale
+
+    @property
+    def reference_x_shift(self):
+        return self.face_detector.reference_x_shift
+
+    @property
+    def reference_y_shift(self):
+        return self.face_detector.reference_y_shift
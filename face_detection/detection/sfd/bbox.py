@@ -26,6 +26,11 @@ except BaseException:
         else:
             return 1.0 * w * h / (sa + sb - w * h)
 
+try:
+    from torchvision.ops import nms as tensor_nms
+except ImportError:
+    tensor_nms = None
+
 
 def bboxlog(x1, y1, x2, y2, axc, ayc, aww, ahh):
     xc, yc, ww, hh = (x2 + x1) / 2, (y2 + y1) / 2, x2 - x1, y2 - y1
@@ -64,6 +69,43 @@ def nms(dets, thresh):
     return keep
 
 
+def batched_nms(dets, thresh, score_threshold=0.5):
+    """NMS over a (B, K, 5) batch of (x1, y1, x2, y2, score) detections.
+
+    Boxes scoring score_threshold or less are dropped first. Returns a
+    (B, M, 5) array with the kept boxes of each image sorted by score and
+    padded with zero rows, M being the most boxes kept in any image. With
+    torchvision this is a single NMS call for the whole batch; otherwise nms()
+    runs per image.
+    """
+    dets = np.asarray(dets)
+    image_idx, det_idx = np.nonzero(dets[..., 4] > score_threshold)
+    candidates = dets[image_idx, det_idx]
+
+    if tensor_nms is not None and len(candidates):
+        boxes = torch.from_numpy(candidates[:, :4]).double()
+        # Same inclusive-pixel areas as nms()
+        boxes[:, 2:] += 1
+        # Shift every image's boxes into its own range so boxes of different images never overlap
+        offset = boxes.max() - boxes.min() + 1
+        boxes += torch.from_numpy(image_idx).double().unsqueeze(1) * offset
+        keep = tensor_nms(boxes, torch.from_numpy(candidates[:, 4]).double(), thresh).numpy()
+        # Scores are in descending order across the batch; a stable sort by image keeps that order per image
+        keep = keep[np.argsort(image_idx[keep], kind='stable')]
+    else:
+        starts = np.searchsorted(image_idx, np.arange(len(dets)))
+        ends = np.append(starts[1:], len(image_idx))
+        keep = np.array([start + k for start, end in zip(starts, ends)
+                         for k in nms(candidates[start:end], thresh)], dtype=np.int64)
+
+    kept_images = image_idx[keep]
+    counts = np.bincount(kept_images, minlength=len(dets))
+    rank = np.arange(len(keep)) - np.repeat(np.cumsum(counts) - counts, counts)
+    out = np.zeros((len(dets), counts.max(initial=0), 5), dtype=dets.dtype)
+    out[kept_images, rank] = candidates[keep]
+    return out
+
+
 def encode(matched, priors, variances):
     """Encode the variances from the priorbox layers into the ground truth boxes
     we have matched (based on jaccard overlap) with the prior boxes.
@@ -7,6 +7,7 @@ import cv2
 import random
 import datetime
 import math
+import functools
 import argparse
 import numpy as np
 
@@ -55,43 +56,78 @@ def detect(net, img, device):
 
     return bboxlist
 
-def batch_detect(net, imgs, device):
-    imgs = imgs - np.array([104, 117, 123])
-    imgs = imgs.transpose(0, 3, 1, 2)
-
+# Subtracted from the network input channels
+MEAN = (104., 117., 123.)
+# Anchor scores below this are never decoded
+SCORE_THRESHOLD = 0.05
+# Candidates kept per image before NMS
+TOP_K = 5000
+
+
+@functools.lru_cache(maxsize=64)
+def prior_grid(stride, height, width, device):
+    """(height * width, 4) priors (cx, cy, w, h) of one feature map, in row-major anchor order"""
+    ys, xs = torch.meshgrid(torch.arange(height, dtype=torch.float32), torch.arange(width, dtype=torch.float32),
+                            indexing='ij')
+    centers = torch.stack([xs.reshape(-1), ys.reshape(-1)], 1) * stride + stride / 2
+    sizes = torch.full_like(centers, stride * 4)
+    return torch.cat([centers, sizes], 1).to(device)
+
+
+def prepare_batch(imgs, device, bgr=False, out=None, memory_format=torch.contiguous_format):
+    """
+    Turns an (N, H, W, 3) image batch, usually uint8, into the float32 NCHW
+    network input. The batch is moved to the device as is; the channel
+    swap (for bgr input), mean subtraction and layout change are then one
+    write per channel into `out`, which is reused when it has the right
+    shape, device and memory format.
+    """
+    imgs = torch.from_numpy(np.ascontiguousarray(imgs)).to(device, non_blocking=True)
+    BB, HH, WW, CC = imgs.shape
+    if (out is None or out.shape != (BB, CC, HH, WW) or out.device != imgs.device
+            or not out.is_contiguous(memory_format=memory_format)):
+        out = torch.empty((BB, CC, HH, WW), dtype=torch.float32, device=imgs.device, memory_format=memory_format)
+    for c, mean in enumerate(MEAN):
+        torch.sub(imgs[..., CC - 1 - c if bgr else c], mean, out=out[:, c])
+    return out
+
+
+def batch_detect(net, imgs, device, score_threshold=SCORE_THRESHOLD, top_k=TOP_K, bgr=False):
+    """
+    Runs s3fd on a batch of RGB images (BGR with bgr=True), or on an input
+    already made by prepare_batch, and decodes every pyramid level at once.
+
+    Returns a (B, K, 5) array of (x1, y1, x2, y2, score) per image, sorted by
+    score; K is at most top_k and rows scoring score_threshold or less have a
+    score of 0.
+    """
     if 'cuda' in device:
         torch.backends.cudnn.benchmark = True
 
-    imgs = torch.from_numpy(imgs).float().to(device)
+    if not isinstance(imgs, torch.Tensor):
+        imgs = prepare_batch(imgs, device, bgr)
     BB, CC, HH, WW = imgs.size()
     with torch.no_grad():
         olist = net(imgs)
 
-    bboxlist = []
-    for i in range(len(olist) // 2):
-        olist[i * 2] = F.softmax(olist[i * 2], dim=1)
-    olist = [oelem.data.cpu() for oelem in olist]
-    for i in range(len(olist) // 2):
-        ocls, oreg = olist[i * 2], olist[i * 2 + 1]
-        FB, FC, FH, FW = ocls.size()  # feature map size
-        stride = 2**(i + 2)    # 4,8,16,32,64,128
-        anchor = stride * 4
-        poss = zip(*np.where(ocls[:, 1, :, :] > 0.05))
-        for Iindex, hindex, windex in poss:
-            axc, ayc = stride / 2 + windex * stride, stride / 2 + hindex * stride
-            score = ocls[:, 1, hindex, windex]
-            loc = oreg[:, :, hindex, windex].contiguous().view(BB, 1, 4)
-            priors = torch.Tensor([[axc / 1.0, ayc / 1.0, stride * 4 / 1.0, stride * 4 / 1.0]]).view(1, 1, 4)
-            variances = [0.1, 0.2]
-            box = batch_decode(loc, priors, variances)
-            box = box[:, 0] * 1.0
-            # cv2.rectangle(imgshow,(int(x1),int(y1)),(int(x2),int(y2)),(0,0,255),1)
-            bboxlist.append(torch.cat([box, score.unsqueeze(1)], 1).cpu().numpy())
-    bboxlist = np.array(bboxlist)
-    if 0 == len(bboxlist):
-        bboxlist = np.zeros((1, BB, 5))
-
-    return bboxlist
+        boxes, scores = [], []
+        variances = [0.1, 0.2]
+        for i in range(len(olist) // 2):
+            ocls, oreg = olist[i * 2], olist[i * 2 + 1]
+            FB, FC, FH, FW = ocls.size()  # feature map size
+            stride = 2**(i + 2)    # 4,8,16,32,64,128
+            priors = prior_grid(stride, FH, FW, str(ocls.device))
+            loc = oreg.permute(0, 2, 3, 1).reshape(FB, FH * FW, 4)
+            boxes.append(batch_decode(loc, priors.unsqueeze(0), variances))
+            scores.append(F.softmax(ocls, dim=1)[:, 1].reshape(FB, FH * FW))
+        boxes, scores = torch.cat(boxes, 1), torch.cat(scores, 1)
+
+        scores, order = scores.topk(min(top_k, scores.size(1)), dim=1)
+        boxes = boxes.gather(1, order.unsqueeze(2).expand(-1, -1, 4))
+        scores = scores.masked_fill(scores <= score_threshold, 0)
+        bboxlist = torch.cat([boxes, scores.unsqueeze(2)], 2)
+
+    return bboxlist.cpu().numpy()
 
 def flip_detect(net, img, device):
     img = cv2.flip(img, 1)
@@ -127,3 +127,98 @@ class s3fd(nn.Module):
         cls1 = torch.cat([bmax, chunk[3]], dim=1)
 
         return [cls1, reg1, cls2, reg2, cls3, reg3, cls4, reg4, cls5, reg5, cls6, reg6]
+
+
+class s3fd_fused(nn.Module):
+    """Inference-only s3fd built from a trained one (see export_s3fd.py).
+
+    The L2Norm scales are folded into the input channels of the head
+    convolutions that follow them, leaving only the per-pixel normalisation,
+    and each level's conf and loc heads are merged into one convolution.
+    Inputs are cast to the weight dtype and outputs returned as float32, so
+    bf16 weights need no changes in the caller. Returns the same twelve maps
+    as s3fd.
+    """
+
+    backbone = ['conv1_1', 'conv1_2', 'conv2_1', 'conv2_2', 'conv3_1', 'conv3_2', 'conv3_3', 'conv4_1', 'conv4_2',
+                'conv4_3', 'conv5_1', 'conv5_2', 'conv5_3', 'fc6', 'fc7', 'conv6_1', 'conv6_2', 'conv7_1', 'conv7_2']
+
+    def __init__(self, net):
+        super(s3fd_fused, self).__init__()
+        for name in self.backbone:
+            setattr(self, name, getattr(net, name))
+        self.eps = net.conv3_3_norm.eps
+
+        self.conv3_3_head = self._merge(net.conv3_3_norm_mbox_conf, net.conv3_3_norm_mbox_loc, net.conv3_3_norm)
+        self.conv4_3_head = self._merge(net.conv4_3_norm_mbox_conf, net.conv4_3_norm_mbox_loc, net.conv4_3_norm)
+        self.conv5_3_head = self._merge(net.conv5_3_norm_mbox_conf, net.conv5_3_norm_mbox_loc, net.conv5_3_norm)
+        self.fc7_head = self._merge(net.fc7_mbox_conf, net.fc7_mbox_loc)
+        self.conv6_2_head = self._merge(net.conv6_2_mbox_conf, net.conv6_2_mbox_loc)
+        self.conv7_2_head = self._merge(net.conv7_2_mbox_conf, net.conv7_2_mbox_loc)
+
+    @staticmethod
+    def _merge(conf, loc, norm=None):
+        """One conv computing conf then loc, with the L2Norm scale (if any) applied to its weights"""
+        merged = nn.Conv2d(conf.in_channels, conf.out_channels + loc.out_channels, kernel_size=conf.kernel_size,
+                           stride=conf.stride, padding=conf.padding)
+        weight = torch.cat([conf.weight.data, loc.weight.data], 0)
+        if norm is not None:
+            weight = weight * norm.weight.data.view(1, -1, 1, 1)
+        merged.weight.data.copy_(weight)
+        merged.bias.data.copy_(torch.cat([conf.bias.data, loc.bias.data], 0))
+        return merged
+
+    def _normalize(self, x):
+        return x / (x.pow(2).sum(dim=1, keepdim=True).sqrt() + self.eps)
+
+    def forward(self, x):
+        x = x.to(self.conv1_1.weight.dtype)
+        h = F.relu(self.conv1_1(x))
+        h = F.relu(self.conv1_2(h))
+        h = F.max_pool2d(h, 2, 2)
+
+        h = F.relu(self.conv2_1(h))
+        h = F.relu(self.conv2_2(h))
+        h = F.max_pool2d(h, 2, 2)
+
+        h = F.relu(self.conv3_1(h))
+        h = F.relu(self.conv3_2(h))
+        h = F.relu(self.conv3_3(h))
+        f3_3 = h
+        h = F.max_pool2d(h, 2, 2)
+
+        h = F.relu(self.conv4_1(h))
+        h = F.relu(self.conv4_2(h))
+        h = F.relu(self.conv4_3(h))
+        f4_3 = h
+        h = F.max_pool2d(h, 2, 2)
+
+        h = F.relu(self.conv5_1(h))
+        h = F.relu(self.conv5_2(h))
+        h = F.relu(self.conv5_3(h))
+        f5_3 = h
+        h = F.max_pool2d(h, 2, 2)
+
+        h = F.relu(self.fc6(h))
+        h = F.relu(self.fc7(h))
+        ffc7 = h
+        h = F.relu(self.conv6_1(h))
+        h = F.relu(self.conv6_2(h))
+        f6_2 = h
+        h = F.relu(self.conv7_1(h))
+        h = F.relu(self.conv7_2(h))
+        f7_2 = h
+
+        out1 = self.conv3_3_head(self._normalize(f3_3)).float()
+        out2 = self.conv4_3_head(self._normalize(f4_3)).float()
+        out3 = self.conv5_3_head(self._normalize(f5_3)).float()
+        out4 = self.fc7_head(ffc7).float()
+        out5 = self.conv6_2_head(f6_2).float()
+        out6 = self.conv7_2_head(f7_2).float()
+
+        # max-out background label
+        bmax = torch.max(torch.max(out1[:, 0:1], out1[:, 1:2]), out1[:, 2:3])
+        cls1 = torch.cat([bmax, out1[:, 3:4]], dim=1)
+
+        return [cls1, out1[:, 4:], out2[:, :2], out2[:, 2:], out3[:, :2], out3[:, 2:],
+                out4[:, :2], out4[:, 2:], out5[:, :2], out5[:, 2:], out6[:, :2], out6[:, 2:]]
@@ -1,4 +1,5 @@
 import os
+import json
 import cv2
 from torch.utils.model_zoo import load_url
 
@@ -12,10 +13,76 @@ models_urls = {
     's3fd': 'https://www.adrianbulat.com/downloads/python-fan/s3fd-619a316812.pth',
 }
 
+# Use the artifact written by export_s3fd.py next to the weights when there is one for this device
+use_optimized_detector = os.environ.get('USE_OPTIMIZED_S3FD', '1') == '1'
+S3FD_META_FILE = 's3fd_meta.json'
+
+
+def optimized_detector_path(path_to_detector, device):
+    """Where export_s3fd.py writes the optimized detector for a device"""
+    stem = os.path.splitext(path_to_detector)[0]
+    return stem + ('.opt.cuda.pt' if 'cuda' in device else '.opt.pt')
+
+
+def load_optimized_detector(path, device):
+    """Loads an export_s3fd.py artifact; returns the module and the memory format of its inputs"""
+    extra_files = {S3FD_META_FILE: ''}
+    model = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+    meta = json.loads(extra_files[S3FD_META_FILE]) if extra_files[S3FD_META_FILE] else {}
+    if meta.get('precision', 'fp32') == 'fp32':
+        # Fuses the ReLUs into the convolutions; the result cannot be serialized, so this runs on every load
+        try:
+            model = torch.jit.optimize_for_inference(model)
+        except Exception as e:
+            print("optimize_for_inference failed, using the frozen graph as is: {}".format(e))
+    memory_format = torch.channels_last if meta.get('memory_format') == 'channels_last' else torch.contiguous_format
+    return model.eval(), memory_format
+
+
+class OnnxS3FD(object):
+    """s3fd exported by export_onnx.py, run on ONNX Runtime's CPU execution provider.
+
+    Called like the torch module: takes an NCHW tensor and returns the list of
+    classification / regression maps as CPU tensors.
+    """
+
+    def __init__(self, path):
+        # The same session configuration as the Wav2Lip graphs (ORT_NUM_THREADS etc.)
+        from backends import create_session
+
+        self.session = create_session(path)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x):
+        x = np.ascontiguousarray(x.cpu().numpy(), dtype=np.float32)
+        return [torch.from_numpy(o) for o in self.session.run(None, {self.input_name: x})]
+
 
 class SFDDetector(FaceDetector):
-    def __init__(self, device, path_to_detector=os.path.join(os.path.dirname(os.path.abspath(__file__)), 's3fd.pth'), verbose=False):
+    def __init__(self, device, path_to_detector=os.path.join(os.path.dirname(os.path.abspath(__file__)), 's3fd.pth'), verbose=False,
+                 backend='torch'):
         super(SFDDetector, self).__init__(device, verbose)
+        # Network input buffer reused across batches
+        self._input = None
+        self.memory_format = torch.contiguous_format
+
+        if backend == 'onnxruntime':
+            # export_onnx.py --arch s3fd writes the graph next to the weights
+            onnx_path = os.path.splitext(path_to_detector)[0] + '.onnx'
+            if not os.path.isfile(onnx_path):
+                raise FileNotFoundError("s3fd ONNX graph not found at {}; export it with: "
+                                        "python export_onnx.py --arch s3fd".format(onnx_path))
+            self.face_detector = OnnxS3FD(onnx_path)
+            return
+        if backend != 'torch':
+            raise ValueError("Unsupported face detector backend: {}".format(backend))
+
+        optimized_path = optimized_detector_path(path_to_detector, device)
+        if use_optimized_detector and os.path.isfile(optimized_path):
+            if verbose:
+                print("Loading optimized s3fd from {}".format(optimized_path))
+            self.face_detector, self.memory_format = load_optimized_detector(optimized_path, device)
+            return
 
         # Initialise the face detector
         if not os.path.isfile(path_to_detector):
@@ -38,13 +105,11 @@ class SFDDetector(FaceDetector):
 
         return bboxlist
 
-    def detect_from_batch(self, images):
-        bboxlists = batch_detect(self.face_detector, images, device=self.device)
-        keeps = [nms(bboxlists[:, i, :], 0.3) for i in range(bboxlists.shape[1])]
-        bboxlists = [bboxlists[keep, i, :] for i, keep in enumerate(keeps)]
-        bboxlists = [[x for x in bboxlist if x[-1] > 0.5] for bboxlist in bboxlists]
-
-        return bboxlists
+    def detect_from_batch(self, images, bgr=False):
+        """(B, K, 5) faces scoring over 0.5 per image, best first; unused rows are all zero"""
+        self._input = prepare_batch(images, self.device, bgr, self._input, self.memory_format)
+        bboxlists = batch_detect(self.face_detector, self._input, device=self.device)
+        return batched_nms(bboxlists, 0.3, score_threshold=0.5)
 
     @property
     def reference_scale(self):
@@ -0,0 +1,100 @@
+import os
+import hashlib
+import cv2
+import numpy as np
+from torch.hub import download_url_to_file
+
+from ..core import FaceDetector
+
+# YUNET_URL points the download at a mirror, e.g. when GitHub is not reachable
+models_urls = {
+    'yunet': os.environ.get('YUNET_URL', 'https://github.com/opencv/opencv_zoo/raw/main/models/face_detection_yunet/'
+                                         'face_detection_yunet_2023mar.onnx'),
+}
+# The weights are pinned by content: a file with any other digest is never loaded
+models_sha256 = {
+    'yunet': '8f2383e4dd3cfbb4553ea8718107fc0423210dc964f9f4280604804ed2552fa4',
+}
+default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'yunet.onnx')
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fetch_weights(path):
+    """Downloads the YuNet weights to path if missing and checks their SHA-256"""
+    if not os.path.isfile(path):
+        # Downloads to a temporary file and only moves it to path if the digest matches
+        download_url_to_file(models_urls['yunet'], path, hash_prefix=models_sha256['yunet'])
+    elif _sha256(path) != models_sha256['yunet']:
+        raise RuntimeError("YuNet weights at {} do not match SHA-256 {}; delete the file to download them "
+                           "again".format(path, models_sha256['yunet']))
+
+
+class YuNetDetector(FaceDetector):
+    """OpenCV's YuNet face detector (cv2.FaceDetectorYN).
+
+    A small CNN that runs in a few milliseconds per frame on the CPU, so it
+    ignores ``device`` and ``backend``. Frames are downscaled so their long
+    side is at most ``max_size`` before detection; boxes are returned in the
+    input's coordinates in the same (B, K, 5) layout as SFDDetector.
+    """
+
+    def __init__(self, device, path_to_detector=default_path, verbose=False, backend='torch', score_threshold=0.6,
+                 max_size=640):
+        super(YuNetDetector, self).__init__(device, verbose)
+
+        # Weights passed in explicitly are the caller's responsibility
+        if path_to_detector == default_path:
+            fetch_weights(path_to_detector)
+        self.face_detector = cv2.FaceDetectorYN.create(path_to_detector, '', (320, 320), score_threshold, 0.3, 5000)
+        self.max_size = max_size
+        self._input_size = None
+
+    def _detect(self, image):
+        """(K, 5) faces of one BGR image, best first"""
+        h, w = image.shape[:2]
+        scale = min(1., self.max_size / max(h, w))
+        if scale < 1:
+            image = cv2.resize(image, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        size = (image.shape[1], image.shape[0])
+        if size != self._input_size:
+            self.face_detector.setInputSize(size)
+            self._input_size = size
+        _, faces = self.face_detector.detect(np.ascontiguousarray(image))
+        if faces is None:
+            return np.zeros((0, 5), dtype=np.float32)
+        # Rows are x, y, w, h, five landmarks, score
+        x, y, fw, fh = faces[:, 0], faces[:, 1], faces[:, 2], faces[:, 3]
+        boxes = np.stack([x, y, x + fw, y + fh, faces[:, -1]], 1) / [scale, scale, scale, scale, 1]
+        return boxes[np.argsort(-boxes[:, 4])].astype(np.float32)
+
+    def detect_from_image(self, tensor_or_path):
+        image = self.tensor_or_path_to_ndarray(tensor_or_path, rgb=False)
+        return [x for x in self._detect(image) if x[-1] > 0.5]
+
+    def detect_from_batch(self, images, bgr=False):
+        """(B, K, 5) faces scoring over 0.5 per image, best first; unused rows are all zero"""
+        faces = [self._detect(image if bgr else image[..., ::-1]) for image in images]
+        faces = [f[f[:, 4] > 0.5] for f in faces]
+        out = np.zeros((len(images), max([len(f) for f in faces], default=0), 5), dtype=np.float32)
+        for i, f in enumerate(faces):
+            out[i, :len(f)] = f
+        return out
+
+    @property
+    def reference_scale(self):
+        return 195
+
+    @property
+    def reference_x_shift(self):
+        return 0
+
+    @property
+    def reference_y_shift(self):
+        return 0
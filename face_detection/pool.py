@@ -0,0 +1,76 @@
+import threading
+from contextlib import contextmanager
+from queue import Queue
+
+from .api import FaceAlignment, LandmarksType
+
+
+class DetectorPool:
+    """Process-wide pool of long-lived :class:`FaceAlignment` instances keyed by device.
+
+    Detectors are constructed lazily on first use and then reused, so the S3FD
+    weights are deserialised once per process instead of once per call. Each
+    detector is handed to a single thread at a time; with ``size > 1`` several
+    threads can run detection on the same device concurrently. ``backend``
+    selects the runtime of the detector network ('torch' or 'onnxruntime').
+    """
+
+    def __init__(self, landmarks_type=LandmarksType._2D, face_detector='sfd', size=1, backend='torch'):
+        self.landmarks_type = landmarks_type
+        self.face_detector = face_detector
+        self.size = size
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._available = {}
+        self._created = {}
+
+    def _queue_for(self, device):
+        with self._lock:
+            if device not in self._available:
+                self._available[device] = Queue()
+                self._created[device] = 0
+            return self._available[device]
+
+    def _checkout(self, device):
+        available = self._queue_for(device)
+        create = False
+        with self._lock:
+            if available.empty() and self._created[device] < self.size:
+                self._created[device] += 1
+                create = True
+        if not create:
+            return available.get()
+        try:
+            return FaceAlignment(self.landmarks_type, flip_input=False, device=device,
+                                 face_detector=self.face_detector, backend=self.backend)
+        except BaseException:
+            with self._lock:
+                self._created[device] -= 1
+            raise
+
+    @contextmanager
+    def acquire(self, device):
+        """Borrow a detector for ``device``; it is returned to the pool on exit."""
+        detector = self._checkout(device)
+        try:
+            yield detector
+        finally:
+            self._available[device].put(detector)
+
+    def warmup(self, device):
+        """Construct a detector for ``device`` ahead of the first request."""
+        with self.acquire(device):
+            pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_detector_pool(face_detector='sfd', size=1, backend='torch'):
+    """Get or create the global detector pool for a detector and runtime backend."""
+    key = (face_detector, backend)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = DetectorPool(face_detector=face_detector, size=size, backend=backend)
+        return _pools[key]
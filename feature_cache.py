@@ -0,0 +1,97 @@
+import os
+from typing import Callable, Dict, Hashable, List, Optional
+import logging
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+class FeatureCache:
+    """Per-job cache of Wav2Lip face-encoder skip features keyed by source frame index.
+
+    Features are kept in memory until `max_memory_mb` is reached. After that
+    they are written to `spill_dir` if one is given, otherwise they are simply
+    not cached. A looping video revisits frames in order, so keeping the first
+    frames gives more hits than LRU eviction, which would always evict the
+    frame needed next.
+    """
+
+    def __init__(self, max_memory_mb: float = 512, spill_dir: Optional[str] = None,
+                 device: str = 'cpu'):
+        self.max_memory_mb = max_memory_mb
+        self.spill_dir = spill_dir
+        self.device = device
+        self._memory = {}  # key -> List[Tensor]
+        self._spilled = {}  # key -> file path
+        self._memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._memory or key in self._spilled
+
+    def __len__(self) -> int:
+        return len(self._memory) + len(self._spilled)
+
+    def get(self, key: Hashable, device: Optional[str] = None) -> Optional[List[torch.Tensor]]:
+        """Return the cached features of one frame, or None; spilled features are loaded onto `device`"""
+        if key in self._memory:
+            return self._memory[key]
+        if key in self._spilled:
+            return torch.load(self._spilled[key], map_location=device or self.device)
+        return None
+
+    def put(self, key: Hashable, feats: List[torch.Tensor]):
+        """Cache the features of one frame (one tensor per encoder block, no batch dim)"""
+        if key in self:
+            return
+        size = sum(f.numel() * f.element_size() for f in feats)
+        if self._memory_bytes + size <= self.max_memory_mb * 1024 ** 2:
+            # clone so a cached frame does not pin the storage of its whole batch
+            self._memory[key] = [f.clone() for f in feats]
+            self._memory_bytes += size
+        elif self.spill_dir:
+            path = os.path.join(self.spill_dir, f'feats_{len(self._spilled)}.pt')
+            torch.save([f.cpu() for f in feats], path)
+            self._spilled[key] = path
+
+    def encode(self, keys: List[Hashable], faces: torch.Tensor,
+               encoder: Callable[[torch.Tensor], List[torch.Tensor]]) -> List[torch.Tensor]:
+        """
+        Return batched encoder features for `faces`, running `encoder` only on
+        frames whose key is not cached yet.
+        """
+        per_frame = [self.get(key, faces.device) for key in keys]
+        missing = [i for i, feats in enumerate(per_frame) if feats is None]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        if len(missing) == len(keys):
+            feats = encoder(faces)
+            for i, key in enumerate(keys):
+                self.put(key, [f[i] for f in feats])
+            return feats
+
+        if missing:
+            index = torch.tensor(missing, device=faces.device)
+            feats = encoder(faces.index_select(0, index))
+            for j, i in enumerate(missing):
+                per_frame[i] = [f[j] for f in feats]
+                self.put(keys[i], per_frame[i])
+
+        return [torch.stack(level) for level in zip(*per_frame)]
+
+    def get_stats(self) -> Dict:
+        """Get cache statistics"""
+        return {
+            'frames': len(self),
+            'in_memory': len(self._memory),
+            'spilled': len(self._spilled),
+            'memory_mb': round(self._memory_bytes / 1024 ** 2, 1),
+            'max_memory_mb': self.max_memory_mb,
+            'hits': self.hits,
+            'misses': self.misses
+        }
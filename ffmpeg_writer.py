@@ -0,0 +1,116 @@
+import subprocess
+import threading
+from typing import List, Optional, Tuple
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class FFmpegWriter:
+    """Streams raw BGR frames into a single ffmpeg process that encodes and muxes audio.
+
+    Frames are written to ffmpeg's stdin as ``bgr24`` rawvideo, so the final
+    mp4 is produced in one encode pass without an intermediate file.
+    """
+
+    def __init__(self, output_path: str, frame_size: Tuple[int, int], fps: float,
+                 audio_path: Optional[str] = None, codec: str = 'libx264',
+                 preset: str = 'veryfast', crf: int = 20, threads: int = 0,
+                 pix_fmt: str = 'yuv420p', ffmpeg_bin: str = 'ffmpeg'):
+        self.output_path = output_path
+        self.frame_w, self.frame_h = frame_size
+        self.frames_written = 0
+        self._stderr_chunks = []
+
+        command = self.build_command(output_path, frame_size, fps, audio_path, codec,
+                                     preset, crf, threads, pix_fmt, ffmpeg_bin)
+        logger.debug(f"Starting ffmpeg: {' '.join(command)}")
+        try:
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            raise RuntimeError(f"ffmpeg executable '{ffmpeg_bin}' not found. Please install FFmpeg.")
+
+        # Drain stderr continuously so a chatty ffmpeg can never block on a full pipe
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True)
+        self._stderr_thread.start()
+
+    @staticmethod
+    def build_command(output_path: str, frame_size: Tuple[int, int], fps: float,
+                      audio_path: Optional[str] = None, codec: str = 'libx264',
+                      preset: str = 'veryfast', crf: int = 20, threads: int = 0,
+                      pix_fmt: str = 'yuv420p', ffmpeg_bin: str = 'ffmpeg') -> List[str]:
+        """Build the ffmpeg command line for a rawvideo stdin input"""
+        frame_w, frame_h = frame_size
+        command = [ffmpeg_bin, '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'bgr24',
+                   '-s', f'{frame_w}x{frame_h}', '-r', str(fps), '-i', 'pipe:0']
+        if audio_path:
+            command += ['-i', audio_path, '-map', '0:v:0', '-map', '1:a:0']
+
+        command += ['-c:v', codec]
+        if codec in ('libx264', 'libx265'):
+            command += ['-preset', preset, '-crf', str(crf)]
+        # yuv420p needs even dimensions; pad odd crops by one pixel instead of failing
+        command += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', pix_fmt,
+                    '-threads', str(threads)]
+
+        if audio_path:
+            command += ['-c:a', 'aac', '-shortest']
+        command += ['-movflags', '+faststart', output_path]
+        return command
+
+    def _drain_stderr(self):
+        for line in iter(self.process.stderr.readline, b''):
+            self._stderr_chunks.append(line)
+
+    @property
+    def stderr(self) -> str:
+        return b''.join(self._stderr_chunks).decode(errors='replace')
+
+    def write(self, frame: np.ndarray):
+        """Write a single HxWx3 uint8 BGR frame"""
+        if frame.shape[:2] != (self.frame_h, self.frame_w):
+            raise ValueError(f"Frame size {frame.shape[1]}x{frame.shape[0]} does not match "
+                             f"writer size {self.frame_w}x{self.frame_h}")
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+        except BrokenPipeError:
+            self.process.wait()
+            self._stderr_thread.join(timeout=5)
+            raise RuntimeError(f"ffmpeg exited while encoding. Error: {self.stderr}")
+        self.frames_written += 1
+
+    def close(self):
+        """Finish encoding and wait for ffmpeg; raises RuntimeError on failure"""
+        if self.process.stdin and not self.process.stdin.closed:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+        returncode = self.process.wait()
+        self._stderr_thread.join(timeout=5)
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed with exit code {returncode}. Error: {self.stderr}")
+
+    def abort(self):
+        """Stop ffmpeg without waiting for a complete output"""
+        try:
+            if self.process.stdin and not self.process.stdin.closed:
+                self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+        return False
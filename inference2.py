@@ -6,6 +6,8 @@ import json, subprocess, random, string
 from tqdm import tqdm
 from glob import glob
 import torch # Ensure torch is imported
+import torch.nn.functional as F
+from hparams import hparams
 try:
     import face_detection # Assuming this is installed or in a path accessible by your Flask app
 except ImportError:
@@ -20,131 +22,827 @@ except ImportError:
     # You might want to raise an error or handle this gracefully.
 
 import platform
-import shutil # For clearing temp directory
+import weakref
+import contextlib
+import shutil
+import tempfile
+from typing import Union
+from itertools import islice
+from numpy.lib.stride_tricks import sliding_window_view
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from model_registry import get_model_registry
+from backends import OnnxWav2Lip, check_backend, load_onnx_wav2lip, onnx_graph_path
+from calibration import get_host_calibration
+from face_boxes import BoxSmoother, check_smoothing, pad_boxes
+from ffmpeg_writer import FFmpegWriter
+from feature_cache import FeatureCache
+from pipeline import BackgroundIterator, BackgroundConsumer
 
 
 # These globals are still useful for shared configuration
 mel_step_size = 16
 device = 'cuda' if torch.cuda.is_available() else 'cpu'
 print('Inference script using {} for inference.'.format(device))
+# Number of S3FD instances kept per device; raise to let concurrent jobs detect in parallel
+detector_pool_size = int(os.environ.get('FACE_DETECTOR_POOL_SIZE', 1))
+# Decoded frames of a short clip are kept for looping when they fit this budget; longer clips are re-decoded
+loop_cache_mb = float(os.environ.get('LOOP_FRAME_CACHE_MB', 256))
+# Face-encoder features of looped frames are reused within this budget; with spilling enabled the rest go to disk
+feature_cache_mb = float(os.environ.get('FACE_FEATURE_CACHE_MB', 512))
+feature_cache_spill = os.environ.get('FACE_FEATURE_CACHE_SPILL', '0') == '1'
+# Use <checkpoint>.fused.pt (see export_fused.py) instead of the checkpoint when it exists
+use_fused_models = os.environ.get('USE_FUSED_MODELS', '1') == '1'
+# With detect_scale='auto', frames are downscaled for S3FD so faces are about this many pixels wide,
+# without taking the short side of the frame below the minimum
+detect_face_res = int(os.environ.get('DETECT_FACE_RES', 180))
+detect_min_frame_res = int(os.environ.get('DETECT_MIN_FRAME_RES', 480))
+
+
+def detection_scale(rect, frame_shape, face_res=None, min_frame_res=None):
+    """
+    Integer factor to downscale frames by for face detection: brings the face
+    in rect (x1, y1, x2, y2) closest to face_res pixels while keeping the short
+    side of the frame at least min_frame_res. Same idea as rescale_frames in
+    evaluation/real_videos_inference.py.
+    """
+    face_res = detect_face_res if face_res is None else face_res
+    min_frame_res = detect_min_frame_res if min_frame_res is None else min_frame_res
+    face_size = max(rect[2] - rect[0], rect[3] - rect[1])
+    short_side = min(frame_shape[:2])
+    factor = 1
+    for candidate in range(2, 16):
+        if short_side // candidate < min_frame_res:
+            break
+        if abs(face_size / candidate - face_res) >= abs(face_size / factor - face_res):
+            break
+        factor = candidate
+    return factor
 
+def _downscale(images, factor):
+    if factor == 1:
+        return images
+    return [cv2.resize(im, (im.shape[1] // factor, im.shape[0] // factor), interpolation=cv2.INTER_AREA)
+            for im in images]
 
-def get_smoothened_boxes(boxes, T):
-    for i in range(len(boxes)):
-        if i + T > len(boxes):
-            window = boxes[len(boxes) - T:]
-        else:
-            window = boxes[i : i + T]
-        boxes[i] = np.mean(window, axis=0)
-    return boxes
-
-def face_detect(images, pads, face_det_batch_size, nosmooth, img_size):
-    detector = face_detection.FaceAlignment(face_detection.LandmarksType._2D,
-                                            flip_input=False, device=device)
-
-    batch_size = face_det_batch_size
+def _upscale_rect(rect, factor):
+    return rect if rect is None or factor == 1 else tuple(v * factor for v in rect)
 
+def _detect_batch(detector, images, batch_size, tracker=None):
+    """Run detection over images, halving the batch size on OOM. Returns (rects, batch_size)."""
     while 1:
         predictions = []
         try:
-            for i in tqdm(range(0, len(images), batch_size), desc="Face Detection"):
-                predictions.extend(detector.get_detections_for_batch(np.array(images[i:i + batch_size])))
+            for i in range(0, len(images), batch_size):
+                predictions.extend(detector.get_detections_for_batch(np.array(images[i:i + batch_size]), tracker))
         except RuntimeError as e:
             if batch_size == 1:
                 raise RuntimeError(f'Image too big to run face detection on GPU. Error: {e}')
             batch_size //= 2
             print('Recovering from OOM error; New face detection batch size: {}'.format(batch_size))
             continue
-        break
+        return predictions, batch_size
+
+def _motion_thumbnail(frame, rect):
+    """Small grayscale thumbnail of the area around rect (x1, y1, x2, y2) for cheap motion checks"""
+    x1, y1, x2, y2 = rect
+    h, w = frame.shape[:2]
+    pad_x, pad_y = (x2 - x1) // 4, (y2 - y1) // 4
+    region = frame[max(0, y1 - pad_y):min(h, y2 + pad_y), max(0, x1 - pad_x):min(w, x2 + pad_x)]
+    if region.size == 0:
+        region = frame
+    thumbnail = cv2.resize(region, (32, 32), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY).astype(np.float32) / 255.
+
+def _box_drift(a, b):
+    """Largest corner displacement between two rects relative to the size of the first"""
+    size = max(a[2] - a[0], a[3] - a[1], 1)
+    return np.abs(np.subtract(b, a)).max() / size
+
+def _keyframe_detections(frames, detect, chunk_size, detect_every, motion_threshold, drift_threshold):
+    """
+    Yields (frame, rect) running `detect` only on keyframes: every detect_every-th
+    frame, any frame whose face region moved more than motion_threshold (mean
+    absolute difference of a 32x32 grayscale thumbnail against the last
+    keyframe) and the last frame. Boxes in between are interpolated linearly,
+    unless the two keyframes' boxes drift apart by more than drift_threshold
+    (relative to the box size), in which case the frames between them are
+    detected as well. Holds at most chunk_size + detect_every frames.
+    """
+    frames = iter(frames)
+    window = []  # [frame, rect, is_key] not yielded yet; rect is None until detected or interpolated
+    anchor = None  # rect of the last yielded keyframe, which precedes window[0]
+    reference = None  # (keyframe, rect the thumbnail is taken around, thumbnail)
+    since_key = 0
+    detected = total = 0
+
+    while 1:
+        chunk = list(islice(frames, chunk_size))
+        end = len(chunk) < chunk_size
+        for frame in chunk:
+            since_key += 1
+            is_key = reference is None or since_key >= detect_every
+            if not is_key:
+                keyframe, region, thumbnail = reference
+                # The latest detected box is the best guess of where the face is now
+                if anchor is not None and region != anchor:
+                    region, thumbnail = anchor, _motion_thumbnail(keyframe, anchor)
+                    reference = (keyframe, region, thumbnail)
+                is_key = np.abs(_motion_thumbnail(frame, region) - thumbnail).mean() > motion_threshold
+            if is_key:
+                since_key = 0
+                region = anchor or (0, 0, frame.shape[1], frame.shape[0])
+                reference = (frame, region, _motion_thumbnail(frame, region))
+            window.append([frame, None, is_key])
+        total += len(chunk)
+        if end and window:
+            window[-1][2] = True
+        if not window:
+            break
+
+        keys = [i for i, (_, rect, is_key) in enumerate(window) if is_key and rect is None]
+        for i, rect in zip(keys, detect([window[i][0] for i in keys])):
+            window[i][1] = rect
+        detected += len(keys)
+
+        # Detect the frames between keyframes whose boxes drifted too far to interpolate
+        keys = [i for i, (_, _, is_key) in enumerate(window) if is_key]
+        redetect, previous, previous_rect = [], -1, anchor
+        for i in keys:
+            rect = window[i][1]
+            if (i - previous > 1 and previous_rect is not None and rect is not None
+                    and _box_drift(previous_rect, rect) > drift_threshold):
+                redetect.extend(range(previous + 1, i))
+            previous, previous_rect = i, rect
+        for i, rect in zip(redetect, detect([window[i][0] for i in redetect])):
+            window[i][1], window[i][2] = rect, True
+        detected += len(redetect)
+
+        # Interpolate up to the last keyframe and yield; the frames after it wait for the next one
+        keys = [i for i, (_, _, is_key) in enumerate(window) if is_key]
+        if not keys:
+            continue
+        previous, previous_rect = -1, anchor
+        for i in keys:
+            rect = window[i][1]
+            for j in range(previous + 1, i):
+                if previous_rect is None or rect is None:
+                    # A keyframe without a face: carry the known box so the error is raised on the keyframe
+                    window[j][1] = rect if previous_rect is None else previous_rect
+                else:
+                    t = (j - previous) / (i - previous)
+                    window[j][1] = tuple(np.rint((1 - t) * np.array(previous_rect) + t * np.array(rect)).astype(int))
+            previous, previous_rect = i, rect
+        for frame, rect, _ in window[:keys[-1] + 1]:
+            yield frame, rect
+        anchor = window[keys[-1]][1]
+        window = window[keys[-1] + 1:]
+        if end:
+            break
+
+    if total:
+        print(f"Face detection ran on {detected} of {total} frames")
+
+def face_detect_stream(frames, pads, face_det_batch_size, nosmooth, faulty_frame_path=None, backend='torch',
+                       detect_every=1, detect_scale=1, box_smoothing='mean', track_faces=False,
+                       face_detector='sfd', batch_limits=None, motion_threshold=0.04, drift_threshold=0.1):
+    """
+    Detects faces over an iterable of frames, yielding (frame, (y1, y2, x1, x2)).
+
+    Frames are consumed face_det_batch_size at a time, so only one detection
+    batch plus the smoothing window is held in memory. With detect_every > 1
+    only keyframes are detected and the boxes in between are interpolated
+    (see _keyframe_detections). Detection runs on frames downscaled by
+    detect_scale, or with 'auto' by a factor picked from the size of the first
+    face found at full resolution (see detection_scale); boxes are mapped back
+    to the full-resolution frames. Boxes are smoothed over time with the
+    box_smoothing method of face_boxes.BoxSmoother. With track_faces, frames
+    are searched around the previous face and only scanned in full when it
+    is lost (see face_detection.FaceTracker). face_detector picks the
+    detector module: 'sfd', 'yunet' or 'cascade' (YuNet with S3FD fallback).
+    batch_limits are the host's learned batch size limits
+    (HostCalibration.limits()) that cap face_det_batch_size; without them the
+    calibration store is only touched to record a batch size that ran out of
+    memory.
+    """
+    smoother = BoxSmoother(T=5, method=box_smoothing, enabled=not nosmooth)
+    batch_size = face_det_batch_size
+    scale = None if detect_scale == 'auto' else int(detect_scale)
+    # Tracking state belongs to this stream; the detectors themselves are shared
+    tracker = face_detection.FaceTracker() if track_faces else None
+
+    def detect_at(images, factor, tracker=None):
+        nonlocal batch_size
+        if not images:
+            return []
+        images = _downscale(images, factor)
+        if batch_size == face_det_batch_size and batch_limits:
+            # Start below a batch size that already ran out of memory at this resolution on this host
+            batch_size = get_host_calibration().limit('face_det_batch_size', images[0].shape, batch_size,
+                                                      batch_limits)
+
+        # The detector is long-lived and shared; borrow it only for this batch
+        pool = face_detection.get_detector_pool(face_detector, size=detector_pool_size, backend=backend)
+        with pool.acquire(device) as detector:
+            predictions, recovered_batch_size = _detect_batch(detector, images, batch_size, tracker)
+        if recovered_batch_size < batch_size:
+            get_host_calibration().record_limit('face_det_batch_size', images[0].shape, recovered_batch_size)
+            batch_size = recovered_batch_size
+        return [_upscale_rect(rect, factor) for rect in predictions]
+
+    def detect(images):
+        nonlocal scale
+        if scale is None and images:
+            first = detect_at(images[:1], 1)
+            if first[0] is None:
+                # No face to measure yet: stay at full resolution for this batch
+                return first + detect_at(images[1:], 1)
+            scale = detection_scale(first[0], images[0].shape)
+            print(f"Running face detection at 1/{scale} of the input resolution")
+            # The probe already found the first face
+            return first + detect_at(images[1:], scale, tracker)
+        return detect_at(images, scale, tracker)
+
+    def emit(smoothed):
+        for frame, (x1, y1, x2, y2) in smoothed:
+            yield frame, (int(y1), int(y2), int(x1), int(x2))
+
+    if detect_every > 1:
+        detections = _keyframe_detections(frames, detect, face_det_batch_size, detect_every,
+                                          motion_threshold, drift_threshold)
+    else:
+        frames = iter(frames)
+        detections = (d for chunk in iter(lambda: list(islice(frames, face_det_batch_size)), [])
+                      for d in zip(chunk, detect(chunk)))
 
-    results = []
-    pady1, pady2, padx1, padx2 = pads
-    for rect, image in zip(predictions, images):
+    for image, rect in detections:
         if rect is None:
             # Save the faulty frame for debugging
-            output_dir = 'temp' # Ensure this exists or create it
-            os.makedirs(output_dir, exist_ok=True)
-            cv2.imwrite(os.path.join(output_dir, 'faulty_frame.jpg'), image)
+            if faulty_frame_path is None:
+                faulty_frame_path = os.path.join('temp', 'faulty_frame.jpg')
+            os.makedirs(os.path.dirname(faulty_frame_path) or '.', exist_ok=True)
+            cv2.imwrite(faulty_frame_path, image)
             raise ValueError('Face not detected! Ensure the video/image contains a face in all the frames or try adjusting pads/box.')
 
-        y1 = max(0, rect[1] - pady1)
-        y2 = min(image.shape[0], rect[3] + pady2)
-        x1 = max(0, rect[0] - padx1)
-        #x2 = min(image.shape[1], image.shape[1], rect[2] + padx2) # Corrected typo: image.shape[1] twice
-        x2 = min(image.shape[1], rect[2] + padx2) 
-        
-        results.append([x1, y1, x2, y2])
+        yield from emit(smoother.push(image, pad_boxes([rect], pads, image.shape)[0]))
 
-    boxes = np.array(results)
-    if not nosmooth: boxes = get_smoothened_boxes(boxes, T=5)
-    results = [[image[y1: y2, x1:x2], (y1, y2, x1, x2)] for image, (x1, y1, x2, y2) in zip(images, boxes)]
+    yield from emit(smoother.flush())
+    if tracker is not None and tracker.tracked + tracker.scanned:
+        print(f"Face tracking searched {tracker.tracked} of {tracker.tracked + tracker.scanned} "
+              f"detected frames near the previous face")
 
-    del detector # Clean up detector
-    return results
+def _preprocess_frame(frame, resize_factor, rotate, crop):
+    if resize_factor > 1:
+        frame = cv2.resize(frame, (frame.shape[1]//resize_factor, frame.shape[0]//resize_factor))
 
-def datagen(frames, mels, box, static, wav2lip_batch_size, img_size, pads, face_det_batch_size, nosmooth):
-    img_batch, mel_batch, frame_batch, coords_batch = [], [], [], []
+    if rotate:
+        frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
 
-    if box[0] == -1:
-        if not static:
-            face_det_results = face_detect(frames, pads, face_det_batch_size, nosmooth, img_size) # BGR2RGB for CNN face detection
+    y1, y2, x1, x2 = crop
+    if x2 == -1: x2 = frame.shape[1]
+    if y2 == -1: y2 = frame.shape[0]
+
+    return frame[y1:y2, x1:x2]
+
+def input_frame_shape(face_path, is_static, resize_factor=1, rotate=False, crop=[0, -1, 0, -1]):
+    """(h, w) of the frames that reach face detection; videos are not decoded"""
+    if is_static:
+        frame = cv2.imread(face_path)
+        if frame is None:
+            raise ValueError(f"Could not read face image at: {face_path}")
+        return frame.shape[:2]
+
+    video_stream = cv2.VideoCapture(face_path)
+    w = int(video_stream.get(cv2.CAP_PROP_FRAME_WIDTH))
+    h = int(video_stream.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    video_stream.release()
+    if resize_factor > 1:
+        h, w = h // resize_factor, w // resize_factor
+    if rotate:
+        h, w = w, h
+    y1, y2, x1, x2 = crop
+    return (h if y2 == -1 else min(y2, h)) - y1, (w if x2 == -1 else min(x2, w)) - x1
+
+def read_frames(face_path, resize_factor=1, rotate=False, crop=[0, -1, 0, -1]):
+    """Decodes a video one frame at a time, applying resize/rotate/crop."""
+    video_stream = cv2.VideoCapture(face_path)
+    if not video_stream.isOpened():
+        raise ValueError(f"Could not open video file at: {face_path}")
+    try:
+        while 1:
+            still_reading, frame = video_stream.read()
+            if not still_reading:
+                break
+            yield _preprocess_frame(frame, resize_factor, rotate, crop)
+    finally:
+        video_stream.release()
+
+def _resolve(value, block=True):
+    """Returns the value of a Future (None if not done and not blocking) or the value itself."""
+    if isinstance(value, Future):
+        return value.result() if block or value.done() else None
+    return value
+
+def _take(frames, num_frames):
+    """Yields at most num_frames frames; num_frames may be a Future that resolves while decoding."""
+    for i, frame in enumerate(frames):
+        limit = _resolve(num_frames, block=False)
+        if limit is not None and i >= limit:
+            return
+        yield frame
+
+def _decode(face_path, resize_factor, rotate, crop, queue_size):
+    frames = read_frames(face_path, resize_factor, rotate, crop)
+    if queue_size > 0:
+        return BackgroundIterator(frames, maxsize=queue_size, name='decode')
+    return frames
+
+def face_frames(face_path, is_static, num_frames, box, pads, face_det_batch_size, nosmooth,
+                resize_factor=1, rotate=False, crop=[0, -1, 0, -1], faulty_frame_path=None,
+                decode_queue_size=0, detector_backend='torch', detect_every=1, detect_scale=1,
+                box_smoothing='mean', track_faces=False, face_detector='sfd', batch_limits=None):
+    """
+    Yields exactly num_frames (frame, coords, source_index) tuples for the output video.
+
+    Video frames are decoded and face-detected as they are consumed. When the
+    audio outlasts the video the clip is looped: boxes from the first pass are
+    reused, and frames come from a small in-memory cache or are decoded again.
+    num_frames may be a Future (e.g. still being computed from the audio), in
+    which case decoding and detection start before it is known. With
+    decode_queue_size > 0 decoding runs on its own thread, and with
+    detect_every > 1 only keyframes are face-detected (see
+    _keyframe_detections); detect_scale, box_smoothing, track_faces,
+    face_detector and batch_limits are passed on to face_detect_stream.
+    source_index is the frame's position in the input clip, so looped frames
+    repeat their index.
+    """
+    if is_static:
+        frame = cv2.imread(face_path)
+        if frame is None:
+            raise ValueError(f"Could not read face image at: {face_path}")
+        if box[0] == -1:
+            _, coords = next(face_detect_stream([frame], pads, face_det_batch_size, nosmooth, faulty_frame_path,
+                                                detector_backend, detect_scale=detect_scale,
+                                                box_smoothing=box_smoothing, face_detector=face_detector,
+                                                batch_limits=batch_limits))
         else:
-            face_det_results = face_detect([frames[0]], pads, face_det_batch_size, nosmooth, img_size)
-    else:
-        print('Using the specified bounding box instead of face detection...')
-        y1, y2, x1, x2 = box
-        face_det_results = [[f[y1: y2, x1:x2], (y1, y2, x1, x2)] for f in frames]
+            print('Using the specified bounding box instead of face detection...')
+            coords = tuple(box)
+        for _ in range(_resolve(num_frames)):
+            yield frame, coords, 0
+        return
+
+    decoded = _decode(face_path, resize_factor, rotate, crop, decode_queue_size)
+    try:
+        frames = _take(decoded, num_frames)
+        if box[0] == -1:
+            first_pass = face_detect_stream(frames, pads, face_det_batch_size, nosmooth, faulty_frame_path,
+                                            detector_backend, detect_every, detect_scale, box_smoothing,
+                                            track_faces, face_detector, batch_limits)
+        else:
+            print('Using the specified bounding box instead of face detection...')
+            first_pass = ((f, tuple(box)) for f in frames)
+
+        all_coords, cached_frames, cached_bytes = [], [], 0
+        for index, (frame, coords) in enumerate(first_pass):
+            all_coords.append(coords)
+            if cached_frames is not None:
+                cached_bytes += frame.nbytes
+                if cached_bytes <= loop_cache_mb * 1024 ** 2:
+                    cached_frames.append(frame)
+                else:
+                    cached_frames = None
+            yield frame, coords, index
+    finally:
+        if isinstance(decoded, BackgroundIterator):
+            decoded.close()
+
+    num_source = len(all_coords)
+    print("Number of frames available for inference:", num_source)
+    if num_source == 0:
+        raise ValueError("No frames could be read from the input face file.")
 
-    for i, m in enumerate(mels):
-        idx = 0 if static else i % len(frames)
-        frame_to_save = frames[idx].copy()
-        face, coords = face_det_results[idx].copy()
+    num_frames = _resolve(num_frames)
+    produced = num_source
+    while produced < num_frames:
+        if cached_frames is not None:
+            source = cached_frames
+        else:
+            source = _decode(face_path, resize_factor, rotate, crop, decode_queue_size)
+        looped = 0
+        try:
+            for index, (frame, coords) in enumerate(zip(source, all_coords)):
+                if produced >= num_frames:
+                    break
+                yield frame, coords, index
+                produced += 1
+                looped += 1
+        finally:
+            if isinstance(source, BackgroundIterator):
+                source.close()
+        if looped == 0:
+            raise RuntimeError(f"Could not re-read frames from {face_path} while looping the video.")
+
+def _fill_faces(faces_u8, img, n):
+    """Fills img[:n] from n staged uint8 crops: scale to [0, 1], duplicate, mask the lower half"""
+    full = img[:n, 3:]
+    full.copy_(torch.from_numpy(faces_u8[:n]).permute(0, 3, 1, 2)).div_(255.)
+    img[:n, :3].copy_(full)
+    img[:n, :3, img.shape[2]//2:] = 0
+    return img[:n]
+
+class _BatchBuffers:
+    """
+    A ring of preallocated batch buffers reused across batches.
+
+    Each slot holds a uint8 (B, H, W, 3) staging array that face crops are
+    resized into, a float32 NCHW (B, 6, H, W) face tensor (masked half first)
+    and a float32 (B, 1, 80, 16) mel tensor. Both tensors can be pinned for
+    faster host-to-device copies. A slot is only refilled after num_slots
+    batches, so it must cover every batch that can be queued or in use
+    downstream at the same time.
+    """
 
-        face = cv2.resize(face, (img_size, img_size))
+    def __init__(self, batch_size, img_size, num_slots=4, pin_memory=False, with_faces=True):
+        self.num_slots = num_slots
+        self._next = 0
+        self._slots = []
+        for _ in range(num_slots):
+            faces_u8 = np.empty((batch_size, img_size, img_size, 3), dtype=np.uint8) if with_faces else None
+            img = (torch.empty((batch_size, 6, img_size, img_size), dtype=torch.float32, pin_memory=pin_memory)
+                   if with_faces else None)
+            mel = torch.empty((batch_size, 1, hparams.num_mels, mel_step_size), dtype=torch.float32,
+                              pin_memory=pin_memory)
+            self._slots.append((faces_u8, img, mel))
+
+    def next_slot(self):
+        slot = self._slots[self._next]
+        self._next = (self._next + 1) % self.num_slots
+        return slot
+
+def _fill_mels(mels, start, mel, n):
+    """Gathers mel chunks [start, start + n) into mel[:n]; mels may be a Future of the MelChunks"""
+    _resolve(mels).gather(start, n, mel.numpy()[:n, 0])
+    return mel[:n]
+
+def datagen(frames, mels, wav2lip_batch_size, img_size, num_buffers=4, pin_memory=False):
+    """
+    Groups (frame, coords, source_index) tuples and mel chunks into model-ready batches.
+
+    Crops and mel chunks are written straight into preallocated buffers, and
+    the yielded img/mel batches are float32 NCHW tensors that view those
+    buffers. They are overwritten num_buffers batches later. Frames are
+    copied into one (B, H, W, 3) array per batch that the output is
+    composited into. mels is a MelChunks, or a Future of one that is first
+    needed when the first batch is full. Frames beyond the last mel chunk are
+    dropped: they can arrive when decoding ran ahead of the audio.
+    """
+    buffers = _BatchBuffers(wav2lip_batch_size, img_size, num_buffers, pin_memory)
+    faces_u8, img, mel = buffers.next_slot()
+    frame_batch, coords_batch, index_batch = None, [], []
+    start = 0
+
+    def num_chunks(block):
+        chunks = _resolve(mels, block)
+        return None if chunks is None else len(chunks)
+
+    for frame, coords, index in frames:
+        k = len(coords_batch)
+        if start + k >= (num_chunks(block=False) or np.inf):
+            break
+        if frame_batch is None:
+            frame_batch = np.empty((wav2lip_batch_size,) + frame.shape, dtype=frame.dtype)
+        y1, y2, x1, x2 = coords
+        cv2.resize(frame[y1: y2, x1:x2], (img_size, img_size), dst=faces_u8[k])
 
-        img_batch.append(face)
-        mel_batch.append(m)
-        frame_batch.append(frame_to_save)
+        frame_batch[k] = frame
         coords_batch.append(coords)
+        index_batch.append(index)
+
+        if len(coords_batch) >= wav2lip_batch_size:
+            n = min(len(coords_batch), num_chunks(block=True) - start)
+            if n > 0:
+                yield (_fill_faces(faces_u8, img, n), _fill_mels(mels, start, mel, n), frame_batch[:n],
+                       coords_batch[:n], index_batch[:n])
+            if n < len(coords_batch):
+                return
+            start += n
+            faces_u8, img, mel = buffers.next_slot()
+            frame_batch, coords_batch, index_batch = None, [], []
+
+    n = min(len(coords_batch), num_chunks(block=True) - start) if coords_batch else 0
+    if n > 0:
+        yield (_fill_faces(faces_u8, img, n), _fill_mels(mels, start, mel, n), frame_batch[:n],
+               coords_batch[:n], index_batch[:n])
+
+def static_datagen(frames, mels, wav2lip_batch_size, img_size, num_buffers=4, pin_memory=False):
+    """
+    datagen for a still image. The face is cropped, resized and masked once and
+    every batch carries that single (1, 6, img_size, img_size) face instead of
+    one copy per mel chunk. The frame batch is a read-only broadcast view of
+    the image, so no batch holds more than the one frame.
+    """
+    frame, coords, _ = next(iter(frames))
+    y1, y2, x1, x2 = coords
+    face = np.ascontiguousarray(cv2.resize(frame[y1: y2, x1:x2], (img_size, img_size))[None])
+    img_batch = torch.empty((1, 6, img_size, img_size), dtype=torch.float32, pin_memory=pin_memory)
+    img_batch = _fill_faces(face, img_batch, 1)
+
+    buffers = _BatchBuffers(wav2lip_batch_size, img_size, num_buffers, pin_memory, with_faces=False)
+    num_chunks = len(_resolve(mels))
+    for start in range(0, num_chunks, wav2lip_batch_size):
+        n = min(wav2lip_batch_size, num_chunks - start)
+        _, _, mel = buffers.next_slot()
+        yield (img_batch, _fill_mels(mels, start, mel, n), np.broadcast_to(frame, (n,) + frame.shape),
+               [coords] * n, [0] * n)
+
+def _to_uint8_patches(pred, size):
+    if tuple(pred.shape[2:]) != size:
+        pred = F.interpolate(pred, size=size, mode='bilinear', align_corners=False)
+    return pred.round_().clamp_(0, 255).to(torch.uint8).permute(0, 2, 3, 1).contiguous().cpu().numpy()
+
+def resize_predictions(pred, coords):
+    """
+    Resizes a (B, 3, H, W) batch of [0, 1] predictions to their face boxes.
+
+    Runs on pred's device, with one interpolate call per distinct box size, and
+    only the uint8 result is copied back. Returns a single (B, h, w, 3) uint8
+    array when every box is identical, otherwise one HxWx3 patch per frame.
+    """
+    # Truncate like the old per-frame astype(np.uint8) before resizing
+    pred = (pred * 255.).floor_()
+    if all(c == coords[0] for c in coords):
+        y1, y2, x1, x2 = coords[0]
+        return _to_uint8_patches(pred, (y2 - y1, x2 - x1))
+
+    groups = {}
+    for i, (y1, y2, x1, x2) in enumerate(coords):
+        groups.setdefault((y2 - y1, x2 - x1), []).append(i)
+
+    patches = [None] * len(coords)
+    for size, idx in groups.items():
+        resized = _to_uint8_patches(pred[idx], size)
+        for i, patch in zip(idx, resized):
+            patches[i] = patch
+    return patches
+
+def paste_predictions(frames, patches, coords):
+    """Pastes the output of resize_predictions into a (B, H, W, 3) frame batch in place."""
+    if isinstance(patches, np.ndarray):
+        y1, y2, x1, x2 = coords[0]
+        frames[:, y1:y2, x1:x2] = patches
+        return frames
+    for f, p, (y1, y2, x1, x2) in zip(frames, patches, coords):
+        f[y1:y2, x1:x2] = p
+    return frames
+
+def composite_frames(frames, patches, coords, canvas=None):
+    """
+    Yields the output frames of a batch, pasting the patches in place. A
+    read-only batch (static_datagen's broadcast still image, whose frames all
+    share one box) is composited one frame at a time into canvas, a writable
+    copy of the image, so each frame is complete only until the next is yielded.
+    """
+    if frames.flags.writeable:
+        yield from paste_predictions(frames, patches, coords)
+        return
+    for patch, (y1, y2, x1, x2) in zip(patches, coords):
+        canvas[y1:y2, x1:x2] = patch
+        yield canvas
+
+class Wav2LipStages:
+    """
+    Split view of a loaded Wav2Lip: encode the face once, then run only the
+    audio encoder and decoder per batch. Uses the model's exported
+    encode_face/encode_audio/decode methods when present and falls back to its
+    submodules for checkpoints scripted before those methods existed.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.native = all(hasattr(model, name) for name in ('encode_face', 'encode_audio', 'decode'))
+        if not self.native:
+            self.face_encoder_blocks = list(model.face_encoder_blocks.children())
+            self.face_decoder_blocks = list(model.face_decoder_blocks.children())
+
+    def encode_face(self, face_sequences):
+        if self.native:
+            return self.model.encode_face(face_sequences)
+        feats = []
+        x = face_sequences
+        for f in self.face_encoder_blocks:
+            x = f(x)
+            feats.append(x)
+        return feats
+
+    def encode_audio(self, audio_sequences):
+        if self.native:
+            return self.model.encode_audio(audio_sequences)
+        return self.model.audio_encoder(audio_sequences)
+
+    def decode(self, audio_embedding, feats):
+        if self.native:
+            return self.model.decode(audio_embedding, feats)
+        x = audio_embedding
+        for f, skip in zip(self.face_decoder_blocks, reversed(feats)):
+            x = f(x)
+            x = torch.cat((x, skip), dim=1)
+        return self.model.output_block(x)
+
+def mel_chunk_starts(num_columns, fps):
+    """
+    First mel column of every video frame's chunk: int(i * 80 / fps) while the
+    chunk fits, then one final chunk aligned to the end of the spectrogram.
+    """
+    mel_idx_multiplier = 80./fps
+    last = num_columns - mel_step_size
+    starts = (np.arange(int((last + 1) / mel_idx_multiplier) + 2) * mel_idx_multiplier).astype(np.int64)
+    return np.append(starts[starts <= last], last)
+
+class MelChunks:
+    """
+    A mel spectrogram split into one (num_mels, mel_step_size) chunk per output video frame.
+
+    Chunks are windows of a strided view of the spectrogram, so none are
+    copied until gather() writes a run of them into a batch buffer with a
+    single np.take. Indexing with an int returns one chunk (a view) and
+    slicing returns a MelChunks sharing the spectrogram.
+    """
 
-        if len(img_batch) >= wav2lip_batch_size:
-            img_batch, mel_batch = np.asarray(img_batch), np.asarray(mel_batch)
+    def __init__(self, mel, fps=None, starts=None):
+        self.mel = np.ascontiguousarray(mel, dtype=np.float32)
+        # (num_columns - mel_step_size + 1, num_mels, mel_step_size) view of every window
+        self.windows = sliding_window_view(self.mel, mel_step_size, axis=1).transpose(1, 0, 2)
+        self.starts = mel_chunk_starts(self.mel.shape[1], fps) if starts is None else starts
 
-            img_masked = img_batch.copy()
-            img_masked[:, img_size//2:] = 0
+    def __len__(self):
+        return len(self.starts)
 
-            img_batch = np.concatenate((img_masked, img_batch), axis=3) / 255.
-            mel_batch = np.reshape(mel_batch, [len(mel_batch), mel_batch.shape[1], mel_batch.shape[2], 1])
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return MelChunks(self.mel, starts=self.starts[key])
+        return self.windows[self.starts[key]]
 
-            yield img_batch, mel_batch, frame_batch, coords_batch
-            img_batch, mel_batch, frame_batch, coords_batch = [], [], [], []
+    def __iter__(self):
+        for start in self.starts:
+            yield self.windows[start]
 
-    if len(img_batch) > 0:
-        img_batch, mel_batch = np.asarray(img_batch), np.asarray(mel_batch)
+    def gather(self, start, n, out):
+        """Copies chunks [start, start + n) into out, a float32 (n, num_mels, mel_step_size) array"""
+        return np.take(self.windows, self.starts[start:start + n], axis=0, out=out, mode='clip')
 
-        img_masked = img_batch.copy()
-        img_masked[:, img_size//2:] = 0
+def _prepare_audio(audio_path, workspace, fps):
+    """
+    Extracts 16 kHz mono audio into the workspace and splits its mel spectrogram
+    into one chunk per output video frame. Returns (wav_path, MelChunks).
+    """
+    temp_audio_path = os.path.join(workspace, 'temp_audio.wav')
 
-        img_batch = np.concatenate((img_masked, img_batch), axis=3) / 255.
-        mel_batch = np.reshape(mel_batch, [len(mel_batch), mel_batch.shape[1], mel_batch.shape[2], 1])
+    # Updated FFmpeg command: force mono, 16-bit, 16kHz
+    if not audio_path.endswith('.wav'):
+        print('Extracting raw audio...')
+        command = f'ffmpeg -y -i "{audio_path}" -ac 1 -ar 16000 -sample_fmt s16 "{temp_audio_path}"'
+        try:
+            subprocess.run(command, shell=True, check=True, capture_output=True)
+            audio_path = temp_audio_path
+        except subprocess.CalledProcessError as e:
+            print(f"FFmpeg error: {e.stderr.decode()}")
+            raise RuntimeError(f"Failed to extract audio from {audio_path}. Error: {e.stderr.decode()}")
+
+    # Load WAV audio
+    wav = audio.load_wav(audio_path, 16000)
+    wav = wav.astype(np.float32)
 
-        yield img_batch, mel_batch, frame_batch, coords_batch
+    # Check audio length
+    print(f"Extracted audio samples: {len(wav)}, duration: {len(wav)/16000:.2f} sec")
+    if len(wav) < 16000:
+        raise ValueError(f"Audio is too short after conversion: only {len(wav)} samples. Please upload a longer clip.")
+
+    mel = audio.melspectrogram(wav)
+    print("Mel spectrogram shape:", mel.shape)
+
+    if np.isnan(mel.reshape(-1)).sum() > 0:
+        raise ValueError('Mel contains nan! Using a TTS voice? Add a small epsilon noise to the wav file and try again')
+
+    mel_chunks = MelChunks(mel, fps)
+    print("Length of mel chunks: {}".format(len(mel_chunks)))
+    return audio_path, mel_chunks
+
+# Optional JSON metadata stored inside a TorchScript archive (see quantize_wav2lip.py)
+MODEL_META_FILE = 'wav2lip_meta.json'
+_model_meta = weakref.WeakKeyDictionary()
 
 def _load(checkpoint_path):
     # Use torch.jit.load for TorchScript archives
+    extra_files = {MODEL_META_FILE: ''}
     if device == 'cuda':
-        model = torch.jit.load(checkpoint_path)
+        model = torch.jit.load(checkpoint_path, _extra_files=extra_files)
     else:
         # Accepts string or torch.device, not a lambda
-        model = torch.jit.load(checkpoint_path, map_location='cpu')
-    return model
+        model = torch.jit.load(checkpoint_path, map_location='cpu', _extra_files=extra_files)
+    meta = json.loads(extra_files[MODEL_META_FILE]) if extra_files[MODEL_META_FILE] else {}
+    return model, meta
 
-def load_model(path):
+def load_model(path, memory_format='contiguous'):
     print("Loading scripted model from:", path)
-    model = _load(path) # returns the TorchScript Module
-    model = model.to(device) # move to CPU or GPU
+    model, meta = _load(path) # returns the TorchScript Module
+    if meta.get('dtype') == 'int8':
+        # Quantized kernels only exist on the CPU; the layout is fixed at conversion time
+        backend = meta.get('backend')
+        if backend in torch.backends.quantized.supported_engines:
+            torch.backends.quantized.engine = backend
+        print(f"Loaded int8 model ({backend}); it runs on the CPU")
+    elif meta.get('fused'):
+        # Frozen by export_fused.py for one device; fuse activations into the convolutions for this process
+        try:
+            model = torch.jit.optimize_for_inference(model, other_methods=meta.get('methods', []))
+        except Exception as e:
+            print(f"optimize_for_inference failed, using the frozen graph as is: {e}")
+    else:
+        model = model.to(device) # move to CPU or GPU
+        if memory_format == 'channels_last':
+            model = model.to(memory_format=torch.channels_last)
+    _model_meta[model] = meta
     return model.eval() # set to eval() mode
 
+def is_quantized(model):
+    return _model_meta.get(model, {}).get('dtype') == 'int8'
+
+def model_device(model):
+    """Device a loaded model runs on; int8 and ONNX Runtime models always stay on the CPU"""
+    return 'cpu' if is_quantized(model) or isinstance(model, OnnxWav2Lip) else device
+
+# Supported values of the per-preset `precision` and `memory_format` settings
+PRECISIONS = ('fp32', 'bf16')
+MEMORY_FORMATS = ('contiguous', 'channels_last')
+
+def check_inference_mode(precision, memory_format):
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unsupported precision '{precision}'. Choose one of: {', '.join(PRECISIONS)}")
+    if memory_format not in MEMORY_FORMATS:
+        raise ValueError(f"Unsupported memory format '{memory_format}'. Choose one of: {', '.join(MEMORY_FORMATS)}")
+
+def fused_checkpoint_path(checkpoint_path, target_device=None):
+    """Where export_fused.py writes the BatchNorm-folded, frozen artifact of a checkpoint for a device"""
+    stem = os.path.splitext(checkpoint_path)[0]
+    return f'{stem}.fused.pt' if (target_device or device) == 'cpu' else f'{stem}.fused.cuda.pt'
+
+def resolve_checkpoint(checkpoint_path):
+    """Prefers an up-to-date fused artifact for this device next to the checkpoint, if one was exported"""
+    if not use_fused_models:
+        return checkpoint_path
+    fused_path = fused_checkpoint_path(checkpoint_path)
+    if os.path.isfile(fused_path) and os.path.getmtime(fused_path) >= os.path.getmtime(checkpoint_path):
+        return fused_path
+    return checkpoint_path
+
+def get_model(checkpoint_path, memory_format='contiguous', backend='torch', precision='fp32'):
+    """Returns the resident model for a checkpoint, prepared for the given memory format, backend and precision"""
+    check_backend(backend)
+    if backend == 'onnxruntime':
+        onnx_path = onnx_graph_path(checkpoint_path)
+        if not os.path.isfile(onnx_path):
+            raise FileNotFoundError(f"No ONNX export of {checkpoint_path}. Create it with: "
+                                    f"python export_onnx.py --checkpoint_path {checkpoint_path}")
+        return get_model_registry().get(onnx_path, load_onnx_wav2lip, variant=backend)
+    # Fused models are converted to mkldnn layouts on load, which autocast cannot run
+    resolved = resolve_checkpoint(checkpoint_path) if precision == 'fp32' else checkpoint_path
+    return get_model_registry().get(resolved, lambda checkpoint: load_model(checkpoint, memory_format),
+                                    variant=memory_format)
+
+def inference_context(precision='fp32'):
+    """Autocast context for the requested precision; fp32 runs the model as saved"""
+    if precision == 'bf16':
+        return torch.autocast(device_type='cuda' if device == 'cuda' else 'cpu', dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def load_reference_batches(face_path, audio_path, max_frames=250, batch_size=32, pads=[0, 10, 0, 0],
+                           box=[-1, -1, -1, -1], face_det_batch_size=16, fps=25., img_size=96):
+    """
+    Decodes, detects and batches a reference clip into a list of
+    (img_batch, mel_batch, frames, coords) tuples that can be replayed through
+    several models, e.g. to compare inference modes or to calibrate.
+    """
+    is_static = face_path.split('.')[-1].lower() in ['jpg', 'png', 'jpeg']
+    if not is_static:
+        video_stream = cv2.VideoCapture(face_path)
+        fps = video_stream.get(cv2.CAP_PROP_FPS)
+        video_stream.release()
+
+    workspace = tempfile.mkdtemp(prefix='reference_')
+    try:
+        _, mel_chunks = _prepare_audio(audio_path, workspace, fps)
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+    mel_chunks = mel_chunks[:max_frames]
+
+    frames = face_frames(face_path, is_static, len(mel_chunks), box, pads, face_det_batch_size, False)
+    # datagen recycles its buffers, so keep a copy of every batch
+    return [(img.clone(), mel.clone(), frame_batch, coords)
+            for img, mel, frame_batch, coords, _ in datagen(frames, mel_chunks, batch_size, img_size)]
+
 
 # New function to be called from Flask app
 def run_inference(
@@ -155,14 +853,28 @@ def run_inference(
     static: bool = False,
     fps: float = 25.,
     pads: list = [0, 10, 0, 0],
-    face_det_batch_size: int = 16,
-    wav2lip_batch_size: int = 128,
+    face_det_batch_size: Union[int, str] = 16,
+    wav2lip_batch_size: Union[int, str] = 128,
     resize_factor: int = 1,
     crop: list = [0, -1, 0, -1],
     box: list = [-1, -1, -1, -1],
     rotate: bool = False,
     nosmooth: bool = False,
-    img_size: int = 96 # Fixed for Wav2Lip
+    img_size: int = 96, # Fixed for Wav2Lip
+    video_codec: str = 'libx264',
+    encoder_preset: str = 'veryfast',
+    crf: int = 20,
+    encoder_threads: int = 0,
+    temp_dir: str = 'temp',
+    output_dir: str = 'results',
+    precision: str = 'fp32',
+    memory_format: str = 'contiguous',
+    backend: str = 'torch',
+    detect_every: int = 1,
+    detect_scale: Union[int, str] = 1,
+    box_smoothing: str = 'mean',
+    track_faces: bool = False,
+    face_detector: str = 'sfd'
 ) -> str:
     """
     Runs the Wav2Lip inference process.
@@ -175,179 +887,198 @@ def run_inference(
         static (bool): If True, use only the first video frame for inference.
         fps (float): Frames per second for static image input.
         pads (list): Padding for face detection (top, bottom, left, right).
-        face_det_batch_size (int): Batch size for face detection.
-        wav2lip_batch_size (int): Batch size for Wav2Lip model(s).
+        face_det_batch_size (int or 'auto'): Batch size for face detection; 'auto' uses this host's calibration.
+        wav2lip_batch_size (int or 'auto'): Batch size for Wav2Lip model(s); 'auto' uses this host's calibration.
         resize_factor (int): Reduce the resolution by this factor.
         crop (list): Crop video to a smaller region (top, bottom, left, right).
         box (list): Constant bounding box for the face.
         rotate (bool): Rotate video right by 90deg.
         nosmooth (bool): Prevent smoothing face detections.
         img_size (int): Image size for the model.
+        video_codec (str): ffmpeg video encoder for the output (e.g. 'libx264').
+        encoder_preset (str): Encoder speed/quality preset (x264/x265 only).
+        crf (int): Constant rate factor (x264/x265 only, lower = better quality).
+        encoder_threads (int): ffmpeg encoder threads (0 = auto).
+        temp_dir (str): Parent folder for the per-job scratch directory.
+        output_dir (str): Folder the output video is written to.
+        precision (str): 'fp32', or 'bf16' to run the model under autocast.
+        memory_format (str): 'contiguous' or 'channels_last' for model weights and inputs.
+        backend (str): 'torch', or 'onnxruntime' to run Wav2Lip and S3FD on ONNX Runtime (see export_onnx.py).
+        detect_every (int): Detect faces on every Nth frame (and on motion) and interpolate the boxes in between.
+        detect_scale (int or 'auto'): Downscale frames by this factor for face detection; 'auto' picks it from the face size.
+        box_smoothing (str): 'mean', 'ema' or 'one_euro' temporal smoothing of the face boxes (see face_boxes.py).
+        track_faces (bool): Search each frame around the previous face and scan the full frame only when it is lost.
+        face_detector (str): 'sfd' (S3FD), 'yunet' (OpenCV YuNet) or 'cascade' (YuNet, S3FD where it is unsure).
 
     Returns:
         str: The path to the generated output video file.
     """
     print(f"Starting inference with: face='{face_path}', audio='{audio_path}', checkpoint='{checkpoint_path}', outfile='{output_filename}'")
+    check_inference_mode(precision, memory_format)
+    check_backend(backend)
+    check_smoothing(box_smoothing)
+    if face_detector not in face_detection.FACE_DETECTORS:
+        raise ValueError(f"Unsupported face detector '{face_detector}'. "
+                         f"Choose one of: {', '.join(face_detection.FACE_DETECTORS)}")
+    if backend == 'onnxruntime':
+        # ONNX Runtime takes contiguous numpy inputs and picks its own layouts
+        memory_format = 'contiguous'
+    input_format = torch.channels_last if memory_format == 'channels_last' else torch.contiguous_format
 
     # Create necessary directories
-    output_dir = 'results'
-    temp_dir = 'temp'
     os.makedirs(output_dir, exist_ok=True)
     os.makedirs(temp_dir, exist_ok=True)
 
-    # Clear temp directory for fresh run
-    for item in os.listdir(temp_dir):
-        item_path = os.path.join(temp_dir, item)
-        if os.path.isfile(item_path):
-            os.remove(item_path)
-        elif os.path.isdir(item_path):
-            shutil.rmtree(item_path)
-
-    # Determine if input is static based on file extension
-    is_static_input = static or (os.path.isfile(face_path) and face_path.split('.')[-1].lower() in ['jpg', 'png', 'jpeg'])
-
-    full_frames = []
-    if is_static_input:
-        full_frames = [cv2.imread(face_path)]
-        if full_frames[0] is None:
-            raise ValueError(f"Could not read face image at: {face_path}")
-    else:
-        video_stream = cv2.VideoCapture(face_path)
-        if not video_stream.isOpened():
-            raise ValueError(f"Could not open video file at: {face_path}")
-        fps = video_stream.get(cv2.CAP_PROP_FPS)
-
-        print('Reading video frames...')
-        while 1:
-            still_reading, frame = video_stream.read()
-            if not still_reading:
-                video_stream.release()
-                break
-            if resize_factor > 1:
-                frame = cv2.resize(frame, (frame.shape[1]//resize_factor, frame.shape[0]//resize_factor))
-
-            if rotate:
-                frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
-
-            y1, y2, x1, x2 = crop
-            if x2 == -1: x2 = frame.shape[1]
-            if y2 == -1: y2 = frame.shape[0]
+    # Every call gets its own scratch directory so concurrent jobs never share temp files
+    workspace = tempfile.mkdtemp(prefix='job_', dir=temp_dir)
+    job_id = os.path.basename(workspace)
+    # Kept outside the workspace so it survives cleanup for debugging
+    faulty_frame_path = os.path.join(temp_dir, f'faulty_frame_{job_id}.jpg')
 
-            frame = frame[y1:y2, x1:x2]
-            full_frames.append(frame)
-
-    print("Number of frames available for inference:", len(full_frames))
-    if not full_frames:
-        raise ValueError("No frames could be read from the input face file.")
-
-    temp_audio_path = os.path.join(temp_dir, 'temp_audio.wav')
+    stages = []
+    audio_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='audio')
+    try:
+        # Determine if input is static based on file extension
+        is_static_input = static or (os.path.isfile(face_path) and face_path.split('.')[-1].lower() in ['jpg', 'png', 'jpeg'])
+
+        if not is_static_input:
+            video_stream = cv2.VideoCapture(face_path)
+            if not video_stream.isOpened():
+                raise ValueError(f"Could not open video file at: {face_path}")
+            fps = video_stream.get(cv2.CAP_PROP_FPS)
+            source_frame_count = int(video_stream.get(cv2.CAP_PROP_FRAME_COUNT))
+            video_stream.release()
+
+        batch_limits = None
+        if 'auto' in (face_det_batch_size, wav2lip_batch_size):
+            # Batch size limits learned from earlier OOMs, read once for the whole job
+            batch_limits = get_host_calibration().limits()
+            frame_shape = input_frame_shape(face_path, is_static_input, resize_factor, rotate, crop)
+            face_det_batch_size, wav2lip_batch_size = get_host_calibration().resolve(
+                face_det_batch_size, wav2lip_batch_size, frame_shape, batch_limits)
+            print(f"Calibrated batch sizes for {frame_shape[1]}x{frame_shape[0]} input: "
+                  f"face detection {face_det_batch_size}, Wav2Lip {wav2lip_batch_size}")
+
+        # Audio extraction and mel computation run while video decoding and face detection start
+        audio_future = audio_executor.submit(_prepare_audio, audio_path, workspace, fps)
+        num_frames, mel_chunks = Future(), Future()
+
+        def on_audio(f):
+            if f.exception():
+                num_frames.set_exception(f.exception())
+                mel_chunks.set_exception(f.exception())
+            else:
+                num_frames.set_result(len(f.result()[1]))
+                mel_chunks.set_result(f.result()[1])
+        audio_future.add_done_callback(on_audio)
+
+        # decode -> detect -> batch run on their own threads with bounded queues between them
+        frame_source = BackgroundIterator(
+            face_frames(face_path, is_static_input, 1 if is_static_input else num_frames, box, pads,
+                        face_det_batch_size, nosmooth, resize_factor, rotate, crop, faulty_frame_path,
+                        decode_queue_size=2 * face_det_batch_size, detector_backend=backend,
+                        detect_every=detect_every, detect_scale=detect_scale, box_smoothing=box_smoothing,
+                        track_faces=track_faces, face_detector=face_detector, batch_limits=batch_limits),
+            maxsize=wav2lip_batch_size, name='detect')
+        stages.append(frame_source)
+        batcher = static_datagen if is_static_input else datagen
+        # Batch buffers are recycled: 2 queued + 1 in the model + 1 being filled
+        gen = BackgroundIterator(batcher(frame_source, mel_chunks, wav2lip_batch_size, img_size,
+                                         num_buffers=4, pin_memory=device == 'cuda'),
+                                 maxsize=2, name='batch')
+        stages.append(gen)
+
+        audio_path, mel_chunks = audio_future.result()
+        final_output_path = os.path.join(output_dir, output_filename)
+
+        # Only worth it when the audio outlasts the clip (or the container does not report a frame count)
+        feature_cache = None
+        if (not is_static_input and feature_cache_mb > 0
+                and (source_frame_count <= 0 or len(mel_chunks) > source_frame_count)):
+            spill_dir = os.path.join(workspace, 'face_features') if feature_cache_spill else None
+            feature_cache = FeatureCache(feature_cache_mb, spill_dir=spill_dir)
+
+        model_loaded = False
+        model = None
+        face_feats = None
+        out = None
+        writer = None
+        canvas = None
+
+        def composite_and_write(item):
+            patches, frames, coords = item
+            for f in composite_frames(frames, patches, coords, canvas):
+                out.write(f)
 
-    # Updated FFmpeg command: force mono, 16-bit, 16kHz
-    if not audio_path.endswith('.wav'):
-        print('Extracting raw audio...')
-        command = f'ffmpeg -y -i "{audio_path}" -ac 1 -ar 16000 -sample_fmt s16 "{temp_audio_path}"'
         try:
-            subprocess.run(command, shell=True, check=True, capture_output=True)
-            audio_path = temp_audio_path
-        except subprocess.CalledProcessError as e:
-            print(f"FFmpeg error: {e.stderr.decode()}")
-            raise RuntimeError(f"Failed to extract audio from {audio_path}. Error: {e.stderr.decode()}")
-    else:
-        shutil.copy(audio_path, temp_audio_path)
-        audio_path = temp_audio_path
-
-    # Load WAV audio
-    wav = audio.load_wav(audio_path, 16000)
-    wav = wav.astype(np.float32)
-
-    # Check audio length
-    print(f"Extracted audio samples: {len(wav)}, duration: {len(wav)/16000:.2f} sec")
-    if len(wav) < 16000:
-        raise ValueError(f"Audio is too short after conversion: only {len(wav)} samples. Please upload a longer clip.")
-
-    mel = audio.melspectrogram(wav)
-    print("Mel spectrogram shape:", mel.shape)
-
-    if np.isnan(mel.reshape(-1)).sum() > 0:
-        raise ValueError('Mel contains nan! Using a TTS voice? Add a small epsilon noise to the wav file and try again')
-
-    mel_chunks = []
-    mel_idx_multiplier = 80./fps
-    i = 0
-    while 1:
-        start_idx = int(i * mel_idx_multiplier)
-        if start_idx + mel_step_size > len(mel[0]):
-            mel_chunks.append(mel[:, len(mel[0]) - mel_step_size:])
-            break
-        mel_chunks.append(mel[:, start_idx : start_idx + mel_step_size])
-        i += 1
+            for i, (img_batch, mel_batch, frames, coords, indices) in enumerate(tqdm(gen, desc="Wav2Lip Inference",
+                                                    total=int(np.ceil(float(len(mel_chunks))/wav2lip_batch_size)))):
+                if not model_loaded:
+                    # Resident models are shared across requests; only the first use pays the load
+                    model = get_model(checkpoint_path, memory_format, backend, precision)
+                    model_loaded = True
+                    print ("Model ready")
+                    run_device = model_device(model)
+                    if (is_quantized(model) or backend == 'onnxruntime') and precision != 'fp32':
+                        print(f"Ignoring precision '{precision}' for an {'int8' if is_quantized(model) else backend} model")
+                        precision = 'fp32'
+                    if is_static_input or feature_cache is not None:
+                        model_stages = Wav2LipStages(model)
+
+                    # Frames go straight into one ffmpeg process that also muxes the audio
+                    frame_h, frame_w = frames[0].shape[:-1]
+                    if is_static_input:
+                        # The one output frame every prediction of a still image is pasted into
+                        canvas = frames[0].copy()
+                    out = FFmpegWriter(final_output_path, (frame_w, frame_h), fps, audio_path=audio_path,
+                                       codec=video_codec, preset=encoder_preset, crf=crf, threads=encoder_threads)
+                    # Compositing and encoding overlap with the next forward pass
+                    writer = BackgroundConsumer(composite_and_write, maxsize=2, name='encode')
+
+                img_batch = img_batch.to(run_device, non_blocking=True, memory_format=input_format)
+                mel_batch = mel_batch.to(run_device, non_blocking=True, memory_format=input_format)
+
+                with torch.no_grad(), inference_context(precision):
+                    if is_static_input:
+                        # The face never changes, so its encoder features are computed once
+                        if face_feats is None:
+                            face_feats = model_stages.encode_face(img_batch)
+                        feats = [f.expand(len(mel_batch), -1, -1, -1) for f in face_feats]
+                        pred = model_stages.decode(model_stages.encode_audio(mel_batch), feats)
+                    elif feature_cache is not None:
+                        # Looped frames reuse the features computed on their first pass
+                        feats = feature_cache.encode(indices, img_batch, model_stages.encode_face)
+                        pred = model_stages.decode(model_stages.encode_audio(mel_batch), feats)
+                    else:
+                        pred = model(mel_batch, img_batch)
+
+                writer.submit((resize_predictions(pred.float(), coords), frames, coords))
+
+            if writer is not None:
+                writer.close()
+        except BaseException:
+            # Kill ffmpeg first so an encode thread blocked on its stdin is released
+            if out is not None:
+                out.abort()
+            if writer is not None:
+                writer.abort()
+            if out is not None and os.path.exists(final_output_path):
+                os.remove(final_output_path)
+            raise
 
-    print("Length of mel chunks: {}".format(len(mel_chunks)))
-
-    # Ensure full_frames matches mel_chunks length, or loop if static
-    if not is_static_input:
-        full_frames = full_frames[:len(mel_chunks)]
-    else:
-        # If static, replicate the first frame for the duration of the audio
-        full_frames = [full_frames[0]] * len(mel_chunks)
-
-
-    gen = datagen(full_frames.copy(), mel_chunks, box, is_static_input, wav2lip_batch_size, img_size, pads, face_det_batch_size, nosmooth)
-
-    output_avi_path = os.path.join(temp_dir, 'result.avi')
-
-    model_loaded = False
-    model = None
-    frame_h, frame_w = 0, 0
-    out = None
-
-    for i, (img_batch, mel_batch, frames, coords) in enumerate(tqdm(gen, desc="Wav2Lip Inference",
-                                            total=int(np.ceil(float(len(mel_chunks))/wav2lip_batch_size)))):
-        if not model_loaded:
-            model = load_model(checkpoint_path)
-            model_loaded = True
-            print ("Model loaded successfully")
-
-            frame_h, frame_w = full_frames[0].shape[:-1]
-            out = cv2.VideoWriter(output_avi_path,
-                                    cv2.VideoWriter_fourcc(*'DIVX'), fps, (frame_w, frame_h))
         if out is None: # In case no frames were generated for some reason
-            raise RuntimeError("Video writer could not be initialized.")
-
+            raise RuntimeError("No frames were processed; the output video could not be written.")
 
-        img_batch = torch.FloatTensor(np.transpose(img_batch, (0, 3, 1, 2))).to(device)
-        mel_batch = torch.FloatTensor(np.transpose(mel_batch, (0, 3, 1, 2))).to(device)
-
-        with torch.no_grad():
-            pred = model(mel_batch, img_batch)
-
-        pred = pred.cpu().numpy().transpose(0, 2, 3, 1) * 255.
-
-        for p, f, c in zip(pred, frames, coords):
-            y1, y2, x1, x2 = c
-            p = cv2.resize(p.astype(np.uint8), (x2 - x1, y2 - y1))
-
-            f[y1:y2, x1:x2] = p
-            out.write(f)
-
-    if out:
-        out.release()
-    else:
-        print("Warning: Video writer was not initialized or no frames were processed.")
-
-
-    final_output_path = os.path.join(output_dir, output_filename)
-    command = f'ffmpeg -y -i "{audio_path}" -i "{output_avi_path}" -strict -2 -q:v 1 "{final_output_path}"'
-
-    try:
-        subprocess.run(command, shell=True, check=True, capture_output=True)
+        out.close()
+        if feature_cache is not None:
+            print("Face feature cache:", feature_cache.get_stats())
         print(f"Output saved to: {final_output_path}")
-    except subprocess.CalledProcessError as e:
-        print(f"FFmpeg final merge error: {e.stderr.decode()}")
-        raise RuntimeError(f"Failed to merge audio and video. Error: {e.stderr.decode()}")
 
-    # Clean up temporary files (optional, but good practice)
-    # shutil.rmtree(temp_dir) # Be careful with this if you want to inspect temp files
+    finally:
+        for stage in reversed(stages):
+            stage.close()
+        audio_executor.shutdown(wait=True)
+        shutil.rmtree(workspace, ignore_errors=True)
 
     return final_output_path
 
@@ -0,0 +1,155 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ModelRegistry:
+    """Process-wide cache of loaded models keyed by checkpoint path, mtime and variant.
+
+    Models stay resident between requests and are evicted least-recently-used
+    first once either the model count or the estimated memory budget is exceeded.
+    A variant (e.g. a memory format) distinguishes differently prepared copies
+    of the same checkpoint.
+    """
+
+    def __init__(self, max_models: int = 2, max_memory_mb: Optional[float] = None):
+        self.max_models = max_models
+        self.max_memory_mb = max_memory_mb
+        self._models = OrderedDict()  # key -> (model, size_bytes)
+        self._lock = threading.RLock()
+        self._load_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _make_key(checkpoint_path: str, variant: Optional[str] = None) -> Tuple[str, float, Optional[str]]:
+        path = os.path.abspath(checkpoint_path)
+        return path, os.path.getmtime(path), variant
+
+    @staticmethod
+    def _estimate_size(model: Any) -> int:
+        """Estimate the resident size of a model from its parameters and buffers"""
+        size = 0
+        try:
+            for tensor in list(model.parameters()) + list(model.buffers()):
+                size += tensor.numel() * tensor.element_size()
+        except Exception:
+            pass
+        return size
+
+    def get(self, checkpoint_path: str, loader: Callable[[str], Any], variant: Optional[str] = None) -> Any:
+        """Return the model for a checkpoint, loading it with `loader` on a miss"""
+        key = self._make_key(checkpoint_path, variant)
+
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return self._models[key][0]
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Load outside the registry lock so other checkpoints stay available,
+        # but make concurrent requests for the same checkpoint wait for one load
+        with load_lock:
+            try:
+                with self._lock:
+                    if key in self._models:
+                        self._models.move_to_end(key)
+                        self.hits += 1
+                        return self._models[key][0]
+
+                model = loader(key[0])
+                # Frozen/quantized archives hide their weights from parameters(); use the file size instead
+                size = self._estimate_size(model) or os.path.getsize(key[0])
+
+                with self._lock:
+                    self.misses += 1
+                    # Drop entries for older versions of the same checkpoint
+                    for stale in [k for k in self._models if k[0] == key[0] and k[1] != key[1]]:
+                        del self._models[stale]
+                    self._models[key] = (model, size)
+                    self._evict(keep=key)
+            finally:
+                # Also after a failed load, so a bad checkpoint does not leave its lock behind
+                with self._lock:
+                    if self._load_locks.get(key) is load_lock:
+                        del self._load_locks[key]
+
+        logger.info(f"Loaded model {key[0]} into registry ({size / 1024 ** 2:.1f} MB)")
+        return model
+
+    def _evict(self, keep: Tuple[str, float, Optional[str]]):
+        """Evict least-recently-used models until within budget"""
+        def over_budget():
+            if self.max_models is not None and len(self._models) > self.max_models:
+                return True
+            if self.max_memory_mb is not None:
+                total = sum(size for _, size in self._models.values())
+                return total > self.max_memory_mb * 1024 ** 2
+            return False
+
+        while over_budget() and len(self._models) > 1:
+            oldest = next(iter(self._models))
+            if oldest == keep:
+                break
+            del self._models[oldest]
+            logger.info(f"Evicted model {oldest[0]} from registry")
+
+    def evict(self, checkpoint_path: str) -> bool:
+        """Remove all cached versions of a checkpoint"""
+        path = os.path.abspath(checkpoint_path)
+        with self._lock:
+            keys = [k for k in self._models if k[0] == path]
+            for k in keys:
+                del self._models[k]
+        return bool(keys)
+
+    def clear(self):
+        """Drop all cached models"""
+        with self._lock:
+            self._models.clear()
+
+    def configure(self, max_models: Optional[int] = None, max_memory_mb: Optional[float] = None):
+        """Update the registry budget and evict if needed"""
+        with self._lock:
+            if max_models is not None:
+                self.max_models = max_models
+            if max_memory_mb is not None:
+                self.max_memory_mb = max_memory_mb
+            if self._models:
+                self._evict(keep=next(reversed(self._models)))
+
+    def get_stats(self) -> Dict:
+        """Get registry statistics"""
+        with self._lock:
+            models: List[Dict] = [
+                {'path': path, 'mtime': mtime, 'variant': variant, 'size_mb': round(size / 1024 ** 2, 2)}
+                for (path, mtime, variant), (_, size) in self._models.items()
+            ]
+            return {
+                'models': models,
+                'max_models': self.max_models,
+                'max_memory_mb': self.max_memory_mb,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+# Global model registry instance
+model_registry = None
+
+def get_model_registry(max_models: Optional[int] = None,
+                       max_memory_mb: Optional[float] = None) -> ModelRegistry:
+    """Get or create the global model registry instance"""
+    global model_registry
+    if model_registry is None:
+        model_registry = ModelRegistry(
+            max_models=max_models if max_models is not None else int(os.environ.get('MODEL_CACHE_MAX_MODELS', 2)),
+            max_memory_mb=max_memory_mb if max_memory_mb is not None else
+                (float(os.environ['MODEL_CACHE_MAX_MB']) if os.environ.get('MODEL_CACHE_MAX_MB') else None)
+        )
+    elif max_models is not None or max_memory_mb is not None:
+        model_registry.configure(max_models, max_memory_mb)
+    return model_registry
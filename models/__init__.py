@@ -1,2 +1,5 @@
 from .wav2lip import Wav2Lip, Wav2Lip_disc_qual
-from .syncnet import SyncNet_color
\ No newline at end of file
+from .stages import Wav2LipFaceEncoder, Wav2LipAudioEncoder, Wav2LipDecoder
+from .syncnet import SyncNet_color
+from .conv import fuse_for_inference
+from .loading import load_eager
\ No newline at end of file
@@ -1,6 +1,7 @@
 import torch
 from torch import nn
 from torch.nn import functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 
 class Conv2d(nn.Module):
     def __init__(self, cin, cout, kernel_size, stride, padding, residual=False, *args, **kwargs):
@@ -15,9 +16,15 @@ class Conv2d(nn.Module):
     def forward(self, x):
         out = self.conv_block(x)
         if self.residual:
-            out += x
+            out = out + x
         return self.act(out)
 
+    def fuse_for_inference(self):
+        """Folds the BatchNorm into the convolution weights (eval mode only)"""
+        if len(self.conv_block) == 2:
+            self.conv_block = nn.Sequential(fuse_conv_bn_eval(self.conv_block[0], self.conv_block[1]))
+        return self
+
 class nonorm_Conv2d(nn.Module):
     def __init__(self, cin, cout, kernel_size, stride, padding, residual=False, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -42,3 +49,17 @@ class Conv2dTranspose(nn.Module):
     def forward(self, x):
         out = self.conv_block(x)
         return self.act(out)
+
+    def fuse_for_inference(self):
+        """Folds the BatchNorm into the transposed convolution weights (eval mode only)"""
+        if len(self.conv_block) == 2:
+            self.conv_block = nn.Sequential(
+                fuse_conv_bn_eval(self.conv_block[0], self.conv_block[1], transpose=True))
+        return self
+
+def fuse_for_inference(model):
+    """Folds BatchNorm into every Conv2d / Conv2dTranspose block of an eval-mode model in place"""
+    for module in list(model.modules()):
+        if isinstance(module, (Conv2d, Conv2dTranspose)):
+            module.fuse_for_inference()
+    return model
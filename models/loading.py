@@ -0,0 +1,17 @@
+import torch
+
+def load_eager(checkpoint_path, model_cls):
+    """
+    Builds an eager `model_cls` instance from either a TorchScript archive or a
+    training checkpoint ({'state_dict': ...}, possibly saved from DataParallel).
+    Loads on the CPU and returns the model in eval mode.
+    """
+    try:
+        state_dict = torch.jit.load(checkpoint_path, map_location='cpu').state_dict()
+    except RuntimeError:
+        checkpoint = torch.load(checkpoint_path, map_location='cpu')
+        state_dict = {k.replace('module.', ''): v for k, v in checkpoint['state_dict'].items()}
+
+    model = model_cls()
+    model.load_state_dict(state_dict)
+    return model.eval()
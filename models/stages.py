@@ -0,0 +1,43 @@
+import torch
+from torch import nn
+
+from .wav2lip import Wav2Lip
+
+# Graph-exportable views of the three Wav2Lip stages, sharing the parent's modules.
+# FX tracing (quantize_wav2lip.py) and ONNX export (export_onnx.py) need plain
+# forward() signatures with one tensor per input and output.
+
+class Wav2LipFaceEncoder(nn.Module):
+    def __init__(self, model: Wav2Lip):
+        super().__init__()
+        self.face_encoder_blocks = model.face_encoder_blocks
+
+    def forward(self, x):
+        feats = []
+        for f in self.face_encoder_blocks:
+            x = f(x)
+            feats.append(x)
+        return feats
+
+class Wav2LipAudioEncoder(nn.Module):
+    def __init__(self, model: Wav2Lip):
+        super().__init__()
+        self.audio_encoder = model.audio_encoder
+
+    def forward(self, x):
+        return self.audio_encoder(x)
+
+class Wav2LipDecoder(nn.Module):
+    """Wav2Lip decoder taking the seven skip features as separate inputs"""
+
+    def __init__(self, model: Wav2Lip):
+        super().__init__()
+        self.face_decoder_blocks = model.face_decoder_blocks
+        self.output_block = model.output_block
+
+    def forward(self, x, f0, f1, f2, f3, f4, f5, f6):
+        feats = [f0, f1, f2, f3, f4, f5, f6]
+        for i, f in enumerate(self.face_decoder_blocks):
+            x = f(x)
+            x = torch.cat((x, feats[len(feats) - 1 - i]), dim=1)
+        return self.output_block(x)
@@ -2,6 +2,7 @@ import torch
 from torch import nn
 from torch.nn import functional as F
 import math
+from typing import List
 
 from .conv import Conv2dTranspose, Conv2d, nonorm_Conv2d
 
@@ -84,40 +85,47 @@ class Wav2Lip(nn.Module):
             nn.Conv2d(32, 3, kernel_size=1, stride=1, padding=0),
             nn.Sigmoid()) 
 
-    def forward(self, audio_sequences, face_sequences):
-        # audio_sequences = (B, T, 1, 80, 16)
-        B = audio_sequences.size(0)
-
-        input_dim_size = len(face_sequences.size())
-        if input_dim_size > 4:
-            audio_sequences = torch.cat([audio_sequences[:, i] for i in range(audio_sequences.size(1))], dim=0)
-            face_sequences = torch.cat([face_sequences[:, :, i] for i in range(face_sequences.size(2))], dim=0)
-
-        audio_embedding = self.audio_encoder(audio_sequences) # B, 512, 1, 1
-
+    @torch.jit.export
+    def encode_face(self, face_sequences):
+        # face_sequences = (B, 6, 96, 96); returns the skip features of every encoder block
         feats = []
         x = face_sequences
         for f in self.face_encoder_blocks:
             x = f(x)
             feats.append(x)
+        return feats
+
+    @torch.jit.export
+    def encode_audio(self, audio_sequences):
+        # audio_sequences = (B, 1, 80, 16)
+        return self.audio_encoder(audio_sequences) # B, 512, 1, 1
 
+    @torch.jit.export
+    def decode(self, audio_embedding, feats: List[torch.Tensor]):
+        # feats is read, not consumed, so the face encoding can be reused across audio chunks
         x = audio_embedding
-        for f in self.face_decoder_blocks:
+        for i, f in enumerate(self.face_decoder_blocks):
             x = f(x)
-            try:
-                x = torch.cat((x, feats[-1]), dim=1)
-            except Exception as e:
-                print(x.size())
-                print(feats[-1].size())
-                raise e
-            
-            feats.pop()
+            x = torch.cat((x, feats[len(feats) - 1 - i]), dim=1)
+
+        return self.output_block(x)
+
+    def forward(self, audio_sequences, face_sequences):
+        # audio_sequences = (B, T, 1, 80, 16)
+        B = audio_sequences.size(0)
+
+        input_dim_size = len(face_sequences.size())
+        if input_dim_size > 4:
+            audio_sequences = torch.cat([audio_sequences[:, i] for i in range(audio_sequences.size(1))], dim=0)
+            face_sequences = torch.cat([face_sequences[:, :, i] for i in range(face_sequences.size(2))], dim=0)
 
-        x = self.output_block(x)
+        audio_embedding = self.encode_audio(audio_sequences)
+        feats = self.encode_face(face_sequences)
+        x = self.decode(audio_embedding, feats)
 
         if input_dim_size > 4:
-            x = torch.split(x, B, dim=0) # [(B, C, H, W)]
-            outputs = torch.stack(x, dim=2) # (B, C, T, H, W)
+            x_split = torch.split(x, B, dim=0) # [(B, C, H, W)]
+            outputs = torch.stack(x_split, dim=2) # (B, C, T, H, W)
 
         else:
             outputs = x
@@ -0,0 +1,145 @@
+import threading
+from queue import Queue, Empty, Full
+from typing import Any, Callable, Iterable, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+class BackgroundIterator:
+    """Runs an iterable on its own thread, handing items over through a bounded queue.
+
+    The producer runs at most `maxsize` items ahead of the consumer, so chaining
+    several of these gives a pipeline whose stages overlap while memory stays
+    bounded. Exceptions raised by the producer are re-raised in the consumer.
+    """
+
+    def __init__(self, iterable: Iterable, maxsize: int = 2, name: Optional[str] = None):
+        self._iterable = iterable
+        self._queue = Queue(maxsize=max(1, maxsize))
+        self._stop = threading.Event()
+        self._finished = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _run(self):
+        try:
+            for item in self._iterable:
+                if not self._put((False, item)):
+                    break
+            else:
+                self._put((True, _END))
+        except BaseException as e:
+            self._put((True, e))
+        finally:
+            close = getattr(self._iterable, 'close', None)
+            if close is not None:
+                try:
+                    close()
+                except Exception as e:
+                    logger.debug(f"Error closing pipeline stage {self._thread.name}: {e}")
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration
+        while 1:
+            try:
+                is_control, item = self._queue.get(timeout=0.1)
+                break
+            except Empty:
+                if not self._thread.is_alive() and self._queue.empty():
+                    self._finished = True
+                    raise StopIteration
+        if is_control:
+            self._finished = True
+            if item is _END:
+                raise StopIteration
+            raise item
+        return item
+
+    def close(self):
+        """Stop the producer and wait for its thread to exit"""
+        self._stop.set()
+        self._finished = True
+        while 1:
+            try:
+                self._queue.get_nowait()
+            except Empty:
+                break
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+class BackgroundConsumer:
+    """Applies `fn` to submitted items on its own thread through a bounded queue.
+
+    `submit` blocks once `maxsize` items are waiting. The first exception raised
+    by `fn` stops the worker and is re-raised from the next `submit` or `close`.
+    """
+
+    def __init__(self, fn: Callable[[Any], None], maxsize: int = 2, name: Optional[str] = None):
+        self._fn = fn
+        self._queue = Queue(maxsize=max(1, maxsize))
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while 1:
+            item = self._queue.get()
+            if item is _END:
+                return
+            if self._error is not None:
+                continue
+            try:
+                self._fn(item)
+            except BaseException as e:
+                self._error = e
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, item):
+        self._raise_if_failed()
+        while 1:
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except Full:
+                self._raise_if_failed()
+
+    def close(self):
+        """Wait for queued items to be processed, re-raising any worker error"""
+        self._queue.put(_END)
+        self._thread.join()
+        self._raise_if_failed()
+
+    def abort(self):
+        """Discard queued items and stop the worker"""
+        while 1:
+            try:
+                self._queue.get_nowait()
+            except Empty:
+                break
+        self._queue.put(_END)
+        self._thread.join(timeout=5)
@@ -0,0 +1,83 @@
+"""
+Compares Wav2Lip output in a faster inference mode (bf16 autocast and/or
+channels_last) against fp32 on a reference clip and reports the pixel delta
+of the composited frames along with the model throughput of both modes.
+
+    python precision_check.py --checkpoint_path checkpoints/wav2lip_gan.pt \
+        --face reference.mp4 --audio reference.wav --precision bf16 --memory_format channels_last
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import torch
+
+import inference2
+
+parser = argparse.ArgumentParser(description='Report the output delta of a Wav2Lip inference mode against fp32')
+
+parser.add_argument('--checkpoint_path', type=str, help='Scripted Wav2Lip checkpoint', required=True)
+parser.add_argument('--face', type=str, help='Reference video/image containing a face', required=True)
+parser.add_argument('--audio', type=str, help='Reference audio', required=True)
+parser.add_argument('--precision', type=str, default='bf16', choices=inference2.PRECISIONS)
+parser.add_argument('--memory_format', type=str, default='contiguous', choices=inference2.MEMORY_FORMATS)
+parser.add_argument('--max_frames', type=int, default=250, help='Compare at most this many frames')
+parser.add_argument('--batch_size', type=int, default=32, help='Batch size for Wav2Lip')
+parser.add_argument('--face_det_batch_size', type=int, default=16)
+parser.add_argument('--pads', nargs='+', type=int, default=[0, 10, 0, 0], help='Padding (top, bottom, left, right)')
+parser.add_argument('--box', nargs='+', type=int, default=[-1, -1, -1, -1],
+                    help='Constant bounding box (top, bottom, left, right) instead of face detection')
+parser.add_argument('--fps', type=float, default=25., help='Frame rate for image inputs')
+parser.add_argument('--max_delta', type=int, default=None,
+                    help='Exit with status 1 if the max pixel delta exceeds this value')
+
+def run_mode(args, batches, precision, memory_format):
+    model = inference2.load_model(args.checkpoint_path, memory_format)
+    input_format = torch.channels_last if memory_format == 'channels_last' else torch.contiguous_format
+    run_device = inference2.model_device(model)
+
+    outputs, elapsed = [], 0.
+    for img, mel, frame_batch, coords in batches:
+        img = img.to(run_device, memory_format=input_format)
+        mel = mel.to(run_device, memory_format=input_format)
+
+        start = time.time()
+        with torch.no_grad(), inference2.inference_context(precision):
+            pred = model(mel, img)
+        pred = pred.float()
+        if run_device == 'cuda':
+            torch.cuda.synchronize()
+        elapsed += time.time() - start
+
+        patches = inference2.resize_predictions(pred, coords)
+        outputs.append(inference2.paste_predictions(frame_batch.copy(), patches, coords))
+
+    return np.concatenate(outputs), elapsed
+
+def main():
+    args = parser.parse_args()
+    inference2.check_inference_mode(args.precision, args.memory_format)
+
+    batches = inference2.load_reference_batches(args.face, args.audio, args.max_frames, args.batch_size,
+                                                args.pads, args.box, args.face_det_batch_size, args.fps)
+    num_frames = sum(len(coords) for _, _, _, coords in batches)
+    print(f"Comparing {num_frames} frames on {inference2.device}")
+
+    reference, reference_time = run_mode(args, batches, 'fp32', 'contiguous')
+    candidate, candidate_time = run_mode(args, batches, args.precision, args.memory_format)
+
+    delta = np.abs(reference.astype(np.int16) - candidate.astype(np.int16))
+    print(f"Mode: precision={args.precision}, memory_format={args.memory_format}")
+    print(f"Max pixel delta: {int(delta.max())}")
+    print(f"Mean pixel delta: {delta.mean():.4f}")
+    print(f"Pixels differing by more than 2: {100. * (delta > 2).mean():.3f}%")
+    print(f"fp32 model throughput: {num_frames / reference_time:.1f} frames/s")
+    print(f"{args.precision}/{args.memory_format} model throughput: {num_frames / candidate_time:.1f} frames/s")
+
+    if args.max_delta is not None and delta.max() > args.max_delta:
+        print(f"Max pixel delta exceeds the allowed {args.max_delta}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
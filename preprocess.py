@@ -29,8 +29,9 @@ parser.add_argument("--preprocessed_root", help="Root folder of the preprocessed
 
 args = parser.parse_args()
 
-fa = [face_detection.FaceAlignment(face_detection.LandmarksType._2D, flip_input=False, 
-									device='cuda:{}'.format(id)) for id in range(args.ngpu)]
+detector_pool = face_detection.get_detector_pool()
+for id in range(args.ngpu):
+	detector_pool.warmup('cuda:{}'.format(id))
 
 template = 'ffmpeg -loglevel panic -y -i {} -strict -2 {}'
 # template2 = 'ffmpeg -hide_banner -loglevel panic -threads 1 -y -i {} -async 1 -ac 1 -vn -acodec pcm_s16le -ar 16000 {}'
@@ -56,7 +57,8 @@ def process_video_file(vfile, args, gpu_id):
 
 	i = -1
 	for fb in batches:
-		preds = fa[gpu_id].get_detections_for_batch(np.asarray(fb))
+		with detector_pool.acquire('cuda:{}'.format(gpu_id)) as detector:
+			preds = detector.get_detections_for_batch(np.asarray(fb))
 
 		for j, f in enumerate(preds):
 			i += 1
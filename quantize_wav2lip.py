@@ -0,0 +1,189 @@
+"""
+Post-training static int8 quantization of a Wav2Lip generator for CPU inference.
+
+The face encoder, audio encoder and decoder are quantized as three FX graphs
+(Conv+BatchNorm folded, ReLU fused), calibrated on local clips and saved as
+one TorchScript archive. That archive keeps the encode_face / encode_audio /
+decode API, so the still-image and looped-video fast paths keep working.
+inference2.load_model recognises the archive from its embedded metadata and
+keeps it on the CPU.
+
+    python quantize_wav2lip.py --checkpoint_path checkpoints/Wav2Lip-SD-GAN.pt \
+        --faces clip1.mp4 clip2.mp4 --audios clip1.wav clip2.wav
+
+The quality report gives the PSNR of the generated mouth region (lower half
+of the 96x96 face) against the fp32 model. With --lse_dir, output videos from
+both models are also rendered for LSE-D / LSE-C scoring via
+evaluation/scores_LSE. Pass --syncnet_dir to run that scoring as well.
+"""
+import argparse
+import json
+import os
+import subprocess
+import time
+from typing import List
+
+import numpy as np
+import torch
+from torch import nn
+from torch.ao.quantization import QConfig, get_default_qconfig_mapping
+from torch.ao.quantization.observer import HistogramObserver, default_weight_observer
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+import inference2
+from models import Wav2Lip, Wav2LipAudioEncoder, Wav2LipDecoder, Wav2LipFaceEncoder, load_eager
+
+parser = argparse.ArgumentParser(description='Quantize a Wav2Lip checkpoint to int8 for CPU inference')
+
+parser.add_argument('--checkpoint_path', type=str, help='Scripted Wav2Lip checkpoint (or training checkpoint)', required=True)
+parser.add_argument('--output', type=str, default=None, help='Output path (default: <checkpoint>.int8.pt)')
+parser.add_argument('--faces', nargs='+', type=str, required=True, help='Calibration videos/images with a face')
+parser.add_argument('--audios', nargs='+', type=str, required=True, help='Audio for each calibration face')
+parser.add_argument('--eval_faces', nargs='+', type=str, default=None,
+                    help='Clips for the quality report (default: the calibration clips)')
+parser.add_argument('--eval_audios', nargs='+', type=str, default=None)
+parser.add_argument('--calib_frames', type=int, default=200, help='Frames used per calibration clip')
+parser.add_argument('--batch_size', type=int, default=32)
+parser.add_argument('--face_det_batch_size', type=int, default=16)
+parser.add_argument('--pads', nargs='+', type=int, default=[0, 10, 0, 0], help='Padding (top, bottom, left, right)')
+parser.add_argument('--box', nargs='+', type=int, default=[-1, -1, -1, -1],
+                    help='Constant bounding box (top, bottom, left, right) instead of face detection')
+parser.add_argument('--backend', type=str, default='x86', choices=['x86', 'fbgemm', 'qnnpack'])
+parser.add_argument('--lse_dir', type=str, default=None,
+                    help='Render fp32 and int8 videos of the eval clips here for LSE scoring')
+parser.add_argument('--syncnet_dir', type=str, default=None,
+                    help='syncnet_python checkout with the evaluation/scores_LSE scripts copied in')
+
+class QuantizedWav2Lip(nn.Module):
+    """Puts the quantized stages back together behind the Wav2Lip inference API"""
+
+    def __init__(self, face_encoder, audio_encoder, decoder):
+        super().__init__()
+        self.face_encoder = face_encoder
+        self.audio_encoder = audio_encoder
+        self.decoder = decoder
+
+    @torch.jit.export
+    def encode_face(self, face_sequences) -> List[torch.Tensor]:
+        return self.face_encoder(face_sequences)
+
+    @torch.jit.export
+    def encode_audio(self, audio_sequences):
+        return self.audio_encoder(audio_sequences)
+
+    @torch.jit.export
+    def decode(self, audio_embedding, feats: List[torch.Tensor]):
+        return self.decoder(audio_embedding, feats[0], feats[1], feats[2], feats[3], feats[4], feats[5], feats[6])
+
+    def forward(self, audio_sequences, face_sequences):
+        return self.decode(self.encode_audio(audio_sequences), self.encode_face(face_sequences))
+
+def qconfig_mapping(backend):
+    mapping = get_default_qconfig_mapping(backend)
+    # Quantized transposed convolutions only support per-tensor weights
+    mapping.set_object_type(nn.ConvTranspose2d, QConfig(
+        activation=HistogramObserver.with_args(reduce_range=backend != 'qnnpack'),
+        weight=default_weight_observer))
+    return mapping
+
+def load_clips(faces, audios, args, max_frames):
+    if len(faces) != len(audios):
+        raise ValueError('Pass one audio file per face clip')
+    batches = []
+    for face, audio_path in zip(faces, audios):
+        print(f"Loading {face} + {audio_path}")
+        batches += inference2.load_reference_batches(face, audio_path, max_frames, args.batch_size,
+                                                     args.pads, args.box, args.face_det_batch_size)
+    return batches
+
+def quantize(model, batches, backend):
+    torch.backends.quantized.engine = backend
+    mapping = qconfig_mapping(backend)
+    img, mel = batches[0][0], batches[0][1]
+    with torch.no_grad():
+        feats = model.encode_face(img)
+        embedding = model.encode_audio(mel)
+
+    face_encoder = prepare_fx(Wav2LipFaceEncoder(model).eval(), mapping, (img,))
+    audio_encoder = prepare_fx(Wav2LipAudioEncoder(model).eval(), mapping, (mel,))
+    decoder = prepare_fx(Wav2LipDecoder(model).eval(), mapping, (embedding, *feats))
+
+    print(f"Calibrating on {sum(len(b[3]) for b in batches)} frames")
+    with torch.no_grad():
+        for img, mel, _, _ in batches:
+            decoder(audio_encoder(mel), *face_encoder(img))
+
+    quantized = QuantizedWav2Lip(convert_fx(face_encoder), convert_fx(audio_encoder), convert_fx(decoder))
+    scripted = torch.jit.script(quantized.eval())
+    return torch.jit.freeze(scripted, preserved_attrs=['encode_face', 'encode_audio', 'decode'])
+
+def mouth_psnr(reference_model, quantized_model, batches):
+    """PSNR of the generated lower half of the face (uint8 scale) per frame, plus model timings"""
+    img_size = batches[0][0].shape[-1]
+    psnrs, reference_time, quantized_time = [], 0., 0.
+    with torch.no_grad():
+        for img, mel, _, _ in batches:
+            start = time.time()
+            reference = reference_model(mel, img)
+            reference_time += time.time() - start
+            start = time.time()
+            quantized = quantized_model(mel, img)
+            quantized_time += time.time() - start
+
+            reference = (reference[:, :, img_size//2:] * 255.).round()
+            quantized = (quantized[:, :, img_size//2:] * 255.).round()
+            mse = ((reference - quantized) ** 2).flatten(1).mean(1).clamp(min=1e-10)
+            psnrs += (10 * torch.log10(255. ** 2 / mse)).tolist()
+    return np.array(psnrs), reference_time, quantized_time
+
+def lse_scores(args, output_path, faces, audios):
+    """Renders both models' output for LSE scoring; runs syncnet_python if --syncnet_dir is set"""
+    results = {}
+    for name, checkpoint in (('fp32', args.checkpoint_path), ('int8', output_path)):
+        video_dir = os.path.abspath(os.path.join(args.lse_dir, name))
+        for i, (face, audio_path) in enumerate(zip(faces, audios)):
+            inference2.run_inference(checkpoint, face, audio_path, f'{i:04d}.mp4', pads=args.pads, box=args.box,
+                                     face_det_batch_size=args.face_det_batch_size,
+                                     wav2lip_batch_size=args.batch_size, output_dir=video_dir)
+        if args.syncnet_dir is None:
+            print(f"{name} videos written to {video_dir}; score them with "
+                  f"'sh calculate_scores_real_videos.sh {video_dir}' in your syncnet_python checkout")
+            continue
+
+        subprocess.run(['sh', 'calculate_scores_real_videos.sh', video_dir], cwd=args.syncnet_dir, check=True)
+        with open(os.path.join(args.syncnet_dir, 'all_scores.txt')) as f:
+            scores = np.array([[float(v) for v in line.split()] for line in f if line.strip()])
+        results[name] = {'LSE-D': float(scores[:, 0].mean()), 'LSE-C': float(scores[:, 1].mean())}
+    return results
+
+def main():
+    args = parser.parse_args()
+    output_path = args.output or os.path.splitext(args.checkpoint_path)[0] + '.int8.pt'
+    eval_faces = args.eval_faces or args.faces
+    eval_audios = args.eval_audios or args.audios
+
+    model = load_eager(args.checkpoint_path, Wav2Lip)
+    calibration = load_clips(args.faces, args.audios, args, args.calib_frames)
+    quantized = quantize(model, calibration, args.backend)
+
+    meta = {'dtype': 'int8', 'backend': args.backend, 'source': os.path.basename(args.checkpoint_path),
+            'calibration_clips': [os.path.basename(f) for f in args.faces],
+            'calibration_frames': sum(len(b[3]) for b in calibration)}
+    torch.jit.save(quantized, output_path, _extra_files={inference2.MODEL_META_FILE: json.dumps(meta)})
+    print(f"Saved int8 model to {output_path}")
+
+    # Report on the saved artifact, loaded the same way inference does
+    quantized = inference2.load_model(output_path)
+    evaluation = calibration if eval_faces is args.faces else load_clips(eval_faces, eval_audios, args, args.calib_frames)
+    psnrs, reference_time, quantized_time = mouth_psnr(model, quantized, evaluation)
+    print("Quality report (mouth region vs fp32):")
+    print(f"  PSNR mean: {psnrs.mean():.2f} dB, min: {psnrs.min():.2f} dB over {len(psnrs)} frames")
+    print(f"  Model throughput: fp32 {len(psnrs) / reference_time:.1f} frames/s, "
+          f"int8 {len(psnrs) / quantized_time:.1f} frames/s")
+
+    if args.lse_dir:
+        for name, scores in lse_scores(args, output_path, eval_faces, eval_audios).items():
+            print(f"  {name}: LSE-D {scores['LSE-D']:.3f}, LSE-C {scores['LSE-C']:.3f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import threading
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+
+import inference2
+
+
+def write_video(path, num_frames, size=(160, 120)):
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'MJPG'), 25, size)
+    for i in range(num_frames):
+        writer.write(np.full((size[1], size[0], 3), i % 256, dtype=np.uint8))
+    writer.release()
+
+
+def resolve_later(future, value, delay):
+    timer = threading.Timer(delay, future.set_result, (value,))
+    timer.start()
+    return timer
+
+
+def test_datagen_drops_frames_decoded_before_slow_mel_prep(tmp_path):
+    # 1 s of audio against an 8 s video: decoding runs far ahead while the mels are computed
+    video = tmp_path / 'face.avi'
+    write_video(video, 200)
+    mels = inference2.MelChunks(np.random.RandomState(0).rand(80, 80).astype(np.float32), fps=25)
+    num_frames, mel_chunks = Future(), Future()
+    timers = [resolve_later(num_frames, len(mels), 0.5), resolve_later(mel_chunks, mels, 0.5)]
+
+    frames = inference2.face_frames(str(video), False, num_frames, [10, 90, 20, 120], [0, 10, 0, 0], 16,
+                                    False, decode_queue_size=32)
+    batches = list(inference2.datagen(frames, mel_chunks, 128, 96))
+    for timer in timers:
+        timer.join()
+
+    assert sum(len(coords) for _, _, _, coords, _ in batches) == len(mels)
+    img, mel, frame_batch, coords, indices = batches[-1]
+    assert len(img) == len(mel) == len(frame_batch) == len(coords) == len(indices)
+    assert indices == list(range(len(mels)))
+    np.testing.assert_array_equal(mel[-1, 0].numpy(), mels[len(mels) - 1])
+
+
+def test_datagen_keeps_every_frame_when_mels_are_ready():
+    mels = inference2.MelChunks(np.random.RandomState(0).rand(80, 160).astype(np.float32), fps=25)
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    frames = ((frame, (10, 90, 20, 120), i) for i in range(len(mels)))
+
+    batches = list(inference2.datagen(frames, mels, 16, 96))
+
+    assert [len(coords) for _, _, _, coords, _ in batches] == [16, 16, len(mels) - 32]
@@ -0,0 +1,65 @@
+import numpy as np
+
+import face_detection
+
+
+class BrightBoxDetector:
+    """Stands in for S3FD: reports the bounding box of the bright pixels of each image"""
+
+    def __init__(self):
+        self.shapes = []
+
+    def detect_from_batch(self, images, bgr=False):
+        self.shapes.append(images.shape[1:3])
+        faces = np.zeros((len(images), 1, 5), dtype=np.float32)
+        for i, image in enumerate(images):
+            ys, xs = np.nonzero(image[..., 0] > 128)
+            if len(xs):
+                faces[i, 0] = (xs.min(), ys.min(), xs.max() + 1, ys.max() + 1, 0.95)
+        return faces
+
+
+def make_aligner(detector):
+    aligner = face_detection.FaceAlignment.__new__(face_detection.FaceAlignment)
+    aligner.face_detector = detector
+    return aligner
+
+
+def talking_head(n, size, frame_shape=(1080, 1920)):
+    """n frames of a size=(w, h) face drifting slowly around the middle of the frame"""
+    w, h = size
+    frames = np.full((n,) + frame_shape + (3,), 40, dtype=np.uint8)
+    for i in range(n):
+        x = (frame_shape[1] - w) // 2 + 2 * i
+        y = (frame_shape[0] - h) // 2 + i
+        frames[i, y:y + h, x:x + w] = 200
+    return frames
+
+
+def run(frames, batch_size=8):
+    detector = BrightBoxDetector()
+    aligner = make_aligner(detector)
+    tracker = face_detection.FaceTracker()
+    rects = []
+    for i in range(0, len(frames), batch_size):
+        rects += aligner.get_detections_for_batch(frames[i:i + batch_size], tracker)
+    return rects, tracker, detector
+
+
+def test_tracking_engages_for_frame_filling_face():
+    frames = talking_head(40, (500, 600))
+    rects, tracker, detector = run(frames)
+
+    # Only the first batch needs a full scan, every later one is searched around the face
+    assert tracker.scanned == 8
+    assert tracker.tracked == 32
+    assert sum(shape != frames.shape[1:3] for shape in detector.shapes) == 4
+    assert rects == make_aligner(BrightBoxDetector()).get_detections_for_batch(frames)
+
+
+def test_tracking_matches_full_scan_for_small_face():
+    frames = talking_head(24, (80, 100))
+    rects, tracker, _ = run(frames)
+
+    assert tracker.tracked == 16
+    assert rects == make_aligner(BrightBoxDetector()).get_detections_for_batch(frames)
@@ -0,0 +1,55 @@
+import pytest
+import torch
+
+pytest.importorskip('onnx')
+pytest.importorskip('onnxruntime')
+
+import export_onnx
+from backends import WAV2LIP_GRAPHS, OnnxWav2Lip, onnx_graph_path
+from models import Wav2Lip
+
+ATOL = 1e-3
+
+
+@pytest.fixture(scope='module')
+def exported(tmp_path_factory):
+    """A randomly initialized Wav2Lip exported like export_onnx.py does, next to a stand-in checkpoint path"""
+    torch.manual_seed(0)
+    model = Wav2Lip().eval()
+    checkpoint_path = str(tmp_path_factory.mktemp('onnx') / 'wav2lip.pth')
+    graphs = export_onnx.wav2lip_graphs(model)
+    for name in WAV2LIP_GRAPHS:
+        module, input_names, output_names, example_inputs = graphs[name]
+        export_onnx.export_graph(module, onnx_graph_path(checkpoint_path, name), input_names, output_names,
+                                 example_inputs, opset=17)
+    return model, checkpoint_path, graphs
+
+
+def fixed_inputs(model, batch_size=3):
+    generator = torch.Generator().manual_seed(1)
+    audio = torch.randn((batch_size,) + export_onnx.AUDIO_SHAPE, generator=generator)
+    face = torch.rand((batch_size,) + export_onnx.FACE_SHAPE, generator=generator)
+    with torch.no_grad():
+        feats = model.encode_face(face)
+        embedding = model.encode_audio(audio)
+    return {'forward': (audio, face), 'encode_face': (face,), 'encode_audio': (audio,),
+            'decode': (embedding, *feats)}
+
+
+@pytest.mark.parametrize('name', WAV2LIP_GRAPHS)
+def test_exported_graph_matches_pytorch(exported, name):
+    model, checkpoint_path, graphs = exported
+    module = graphs[name][0]
+    inputs = fixed_inputs(model)[name]
+
+    assert export_onnx.max_difference(module, onnx_graph_path(checkpoint_path, name), inputs) <= ATOL
+
+
+def test_onnx_backend_matches_pytorch(exported):
+    model, checkpoint_path, _ = exported
+    audio, face = fixed_inputs(model)['forward']
+    onnx_model = OnnxWav2Lip(onnx_graph_path(checkpoint_path))
+
+    with torch.no_grad():
+        expected = model(audio, face)
+    assert (onnx_model(audio, face) - expected).abs().max().item() <= ATOL